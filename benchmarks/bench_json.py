@@ -0,0 +1,33 @@
+"""Decode time of a synthetic get_dms payload for every installed JSON backend.
+
+Run from the repository root with ``python -m benchmarks.bench_json [channels]``.
+"""
+
+import sys
+import timeit
+
+from discord_sender.codec import available_codecs, get_codec
+from discord_sender.stub import synthetic_channels
+
+
+def main(channels: int = 5000, repeat: int = 5) -> dict[str, dict[str, float]]:
+    body = get_codec("json").dumps(synthetic_channels(channels))
+    results = {}
+    for name in available_codecs():
+        backend = get_codec(name)
+        loads = min(timeit.repeat(lambda: backend.loads(body), number=1, repeat=repeat))
+        dms = min(
+            timeit.repeat(lambda: backend.decode_dms(body), number=1, repeat=repeat)
+        )
+        results[name] = {"loads": loads, "decode_dms": dms}
+    print(f"{channels} channels, {len(body) / 1024:.0f} KiB")
+    for name, timing in results.items():
+        print(
+            f"{name:>8}: loads {timing['loads'] * 1000:7.2f} ms"
+            f"  decode_dms {timing['decode_dms'] * 1000:7.2f} ms"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,91 @@
+"""Bytes per DM channel held in memory, dict based models vs the slots models.
+
+Run from the repository root with ``python -m benchmarks.bench_memory [channels]``.
+"""
+
+import gc
+import sys
+import tracemalloc
+
+from discord_sender.channel import Channel
+from discord_sender.discord import parse_dms
+from discord_sender.stub import synthetic_channels
+
+
+class LegacyOtherUser:
+    # The models as they were before __slots__ and interning
+    def __init__(self, user_id, username=None, global_name=None, is_bot=False):
+        self.user_id = user_id
+        self.username = username
+        self.is_bot = is_bot
+        self.global_name = global_name
+
+
+class LegacyChannel:
+    def __init__(self, channel_id, recipients, chan_type=1, name=None):
+        self.channel_id = channel_id
+        self.is_in_server = False
+        self.recipients = recipients
+        self.to = {user.username: user for user in recipients}
+        self.type = chan_type
+        self.name = name
+        self.channel_type = "DM" if chan_type == 1 else None
+
+
+def legacy_parse(payload):
+    return [
+        LegacyChannel(
+            channel["id"],
+            [
+                LegacyOtherUser(
+                    other["id"],
+                    other.get("username"),
+                    other.get("global_name"),
+                    other.get("bot", False),
+                )
+                for other in channel["recipients"]
+            ],
+            channel["type"],
+            channel.get("name"),
+        )
+        for channel in payload
+    ]
+
+
+def current_parse(payload):
+    dms = parse_dms(payload)
+    for dm in dms:
+        dm.to  # Materialize everything so the comparison is fair
+    return dms
+
+
+def measure(parse, payload) -> int:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    models = parse(payload)
+    for model in models:
+        if isinstance(model, Channel):
+            # Drop the raw json so only the models are counted
+            model._raw_recipients = None
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del models
+    return used
+
+
+def main(channels: int = 5000) -> dict[str, float]:
+    payload = synthetic_channels(channels)
+    results = {
+        "before": measure(legacy_parse, payload) / channels,
+        "after": measure(current_parse, payload) / channels,
+    }
+    for name, per_channel in results.items():
+        print(f"{name:>6}: {per_channel:8.1f} bytes/channel")
+    print(f" saved: {1 - results['after'] / results['before']:8.1%}")
+    return results
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
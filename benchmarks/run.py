@@ -0,0 +1,172 @@
+"""Offline benchmarks against the local stand-in server.
+
+Run from the repository root::
+
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --compare bench.json
+
+With ``--compare`` the run fails if a metric regressed by more than ``--threshold``.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from importlib import metadata
+
+from discord_sender.discord import DiscordUser
+from discord_sender.stub import (STUB_TOKEN, StubDiscordServer,
+                                 synthetic_channels)
+from discord_sender.transport import Transport
+
+# Metrics where a bigger number is better, everything else is seconds
+THROUGHPUT = {"send_throughput"}
+
+
+def _user(server: StubDiscordServer) -> DiscordUser:
+    return DiscordUser(transport=Transport(base_url=server.url))
+
+
+def bench_login(server: StubDiscordServer, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        user = _user(server)
+        start = time.perf_counter()
+        user.login_with_token(STUB_TOKEN)
+        timings.append(time.perf_counter() - start)
+        user.close()
+    return statistics.median(timings)
+
+
+def bench_get_dms(server: StubDiscordServer, repeat: int) -> float:
+    user = _user(server).login_with_token(STUB_TOKEN)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        user.get_dms(True)
+        timings.append(time.perf_counter() - start)
+    user.close()
+    return statistics.median(timings)
+
+
+def bench_parse(channels: list[dict], repeat: int) -> float:
+    transport = Transport()
+    body = transport.codec.dumps(channels)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        transport.codec.decode_dms(body)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def bench_send(server: StubDiscordServer, count: int) -> float:
+    user = _user(server).login_with_token(STUB_TOKEN)
+    channel_id = server.channels[0]["id"]
+    start = time.perf_counter()
+    for n in range(count):
+        user.send_message_to_channel(str(n), channel_id)
+    elapsed = time.perf_counter() - start
+    user.close()
+    return count / elapsed
+
+
+def run(
+    dm_counts: list[int],
+    sends: int = 200,
+    repeat: int = 5,
+    latency: float = 0.0,
+    rate_limit_every: int = 0,
+) -> dict[str, float]:
+    results = {}
+    with StubDiscordServer(channels=synthetic_channels(1), latency=latency) as server:
+        results["login_token"] = bench_login(server, repeat)
+    for count in dm_counts:
+        channels = synthetic_channels(count)
+        with StubDiscordServer(channels=channels, latency=latency) as server:
+            results[f"get_dms[{count}]"] = bench_get_dms(server, repeat)
+        results[f"parse_dms[{count}]"] = bench_parse(channels, repeat)
+    with StubDiscordServer(
+        channels=synthetic_channels(1),
+        latency=latency,
+        rate_limit_every=rate_limit_every,
+    ) as server:
+        results["send_throughput"] = bench_send(server, sends)
+    return results
+
+
+def compare(
+    old: dict[str, float], new: dict[str, float], threshold: float
+) -> list[str]:
+    regressions = []
+    for name, value in new.items():
+        before = old.get(name)
+        if not before:
+            continue
+        if name in THROUGHPUT:
+            change = (before - value) / before
+        else:
+            change = (value - before) / before
+        if change > threshold:
+            regressions.append(f"{name}: {before:.6g} -> {value:.6g} ({change:+.1%})")
+    return regressions
+
+
+def _version() -> str:
+    try:
+        return metadata.version("discord-sender")
+    except metadata.PackageNotFoundError:
+        return "dev"
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dms", default="100,1000,5000", help="dm counts to test")
+    parser.add_argument("--sends", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds")
+    parser.add_argument(
+        "--rate-limit-every", type=int, default=0, help="answer every n-th with 429"
+    )
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--compare", help="results file of a previous run")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    results = run(
+        [int(count) for count in args.dms.split(",")],
+        sends=args.sends,
+        repeat=args.repeat,
+        latency=args.latency,
+        rate_limit_every=args.rate_limit_every,
+    )
+    for name, value in results.items():
+        unit = "msg/s" if name in THROUGHPUT else "ms"
+        shown = value if name in THROUGHPUT else value * 1000
+        print(f"{name:>20}: {shown:10.2f} {unit}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "version": _version(),
+                    "python": platform.python_version(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        regressions = compare(previous["results"], results, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
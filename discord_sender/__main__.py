@@ -1,20 +1,102 @@
+import argparse
+import json
 import os
 import sys
+from contextlib import contextmanager
 
-if "--accept-eula" in sys.argv:
-    CONFIG = {
-        "nt": os.path.expanduser("~\\AppData\\Local\\discord-sender"),
-        "other": os.path.expanduser("~/.config/discord-sender"),
-    }
-    cfg = CONFIG["nt"] if os.name == "nt" else CONFIG["other"]
-    if not os.path.exists(os.path.join(cfg, ".eulaaccepted")):
-        if not os.path.exists(cfg):
-            os.mkdir(cfg)
-    with open(os.path.join(cfg, ".eulaaccepted"), "a") as f:
-        pass
-    os.chmod(os.path.join(cfg, ".eulaaccepted"), 0o777)
-    print("The eula was successfully accepted")
-    sys.exit(0)
-print(
-    "usage: python -m discord_sender --accept-eula\nOnly use this if the import hook fails."
-)
+from . import bench
+from .config import accept_eula, eula_path
+
+
+def _add_target_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--base-url", help="api to measure, a local stub server is started if not set"
+    )
+    parser.add_argument("--token", help="defaults to $DISCORD_TOKEN with --base-url")
+    parser.add_argument("--channel", help="channel id to send to with --base-url")
+    parser.add_argument("--user", help="user id to resolve with --base-url")
+    parser.add_argument("--dms", type=int, default=100, help="dms of the stub server")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="stub server latency in seconds"
+    )
+    parser.add_argument(
+        "--ops",
+        default="login,get_dms,resolve,send",
+        help="comma separated operations to run",
+    )
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=5)
+
+
+@contextmanager
+def _target(parser: argparse.ArgumentParser, args):
+    if args.base_url is None:
+        with bench.stub_target(args.dms, args.latency) as target:
+            yield target
+        return
+    token = args.token or os.environ.get("DISCORD_TOKEN")
+    if not token:
+        parser.error("--base-url needs --token or $DISCORD_TOKEN")
+    yield bench.Target(args.base_url, token, args.channel, args.user)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m discord_sender")
+    parser.add_argument(
+        "--accept-eula",
+        action="store_true",
+        help="accept the eula, only use this if the prompt on first use fails",
+    )
+    commands = parser.add_subparsers(dest="command")
+    bench_parser = commands.add_parser(
+        "bench", help="measure latency, throughput and allocations"
+    )
+    _add_target_arguments(bench_parser)
+    bench_parser.add_argument("--json", action="store_true", help="print json")
+    profile_parser = commands.add_parser(
+        "profile", help="show where the time goes with cProfile"
+    )
+    _add_target_arguments(profile_parser)
+    profile_parser.add_argument(
+        "--output-dir", help="write <op>.prof and <op>.tracemalloc dumps here"
+    )
+    profile_parser.add_argument(
+        "--top", type=int, default=15, help="functions shown per operation"
+    )
+    args = parser.parse_args(argv)
+
+    if args.accept_eula:
+        accept_eula()
+        os.chmod(eula_path(), 0o777)
+        print("The eula was successfully accepted")
+        return 0
+    if args.command is None:
+        parser.print_help()
+        return 0
+
+    names = [name for name in args.ops.split(",") if name]
+    unknown = set(names) - set(bench.OPERATIONS)
+    if unknown:
+        parser.error(f"unknown operations: {', '.join(sorted(unknown))}")
+    with _target(parser, args) as target:
+        if args.command == "bench":
+            results = bench.run_bench(target, names, args.iterations, args.warmup)
+            if args.json:
+                print(json.dumps(results, indent=2))
+            else:
+                print(bench.format_results(results))
+            return 0
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+        profiles = bench.run_profile(
+            target, names, args.iterations, args.warmup, args.output_dir
+        )
+    for name, stats in profiles.items():
+        print(f"== {name} ==")
+        # Only the library's own functions
+        stats.sort_stats("cumulative").print_stats("discord_sender", args.top)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
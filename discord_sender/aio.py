@@ -0,0 +1,302 @@
+import warnings
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+from .cache import ChannelCache, ChannelIdMap
+from .channel import Channel, ChannelResolution
+from .codec import JSONCodec, get_codec
+from .config import check_eula
+from .discord import UNKNOWN_USER_CODES, handle_error
+from .discord_exceptions import *
+from .info import DiscordLoginInfo
+from .other import OtherUser
+from .singleflight import AsyncSingleFlight
+from .tools import make_nonce
+from .transport import API_PATH, DISCORD_URL
+
+
+class AsyncResponse:
+    def __init__(self, status_code: int, content: bytes, codec: JSONCodec):
+        self.status_code: int = status_code
+        self.ok: bool = status_code < 400
+        self.content: bytes = content
+        self.codec: JSONCodec = codec
+
+    def json(self):
+        return self.codec.loads(self.content)
+
+
+class AsyncDiscordUser:
+    def __init__(
+        self,
+        base_url: str = DISCORD_URL,
+        pool_size: int = 10,
+        timeout: float = 30.0,
+        connect_timeout: float = 5.0,
+        cache_ttl: float = 60.0,
+        cache_size: int = 1024,
+        session: "aiohttp.ClientSession | None" = None,
+        codec: JSONCodec | str | None = None,
+    ):
+        if aiohttp is None:  # pragma: no cover
+            raise ImportError(
+                'AsyncDiscordUser needs aiohttp, install it with "pip install aiohttp"'
+            )
+        self.base_url: str = base_url.rstrip("/")
+        self.api_url: str = self.base_url + API_PATH
+        self.pool_size: int = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.codec: JSONCodec = (
+            codec if isinstance(codec, JSONCodec) else get_codec(codec)
+        )
+        self.user_info: DiscordLoginInfo | None = None
+        self.__logged_in: bool = False
+        self.session: aiohttp.ClientSession | None = session
+        self._owns_session: bool = session is None
+        self.auth_method: str | None = None
+        self.channel_cache: ChannelCache = ChannelCache(cache_ttl, cache_size)
+        self.channel_ids: ChannelIdMap = ChannelIdMap()
+        self.single_flight: AsyncSingleFlight = AsyncSingleFlight()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self) -> None:
+        if self.session is not None and self._owns_session:
+            await self.session.close()
+        self.session = None
+
+    def logged_in(self) -> bool:
+        return self.__logged_in
+
+    def _open(self) -> "aiohttp.ClientSession":
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=self.timeout,
+            )
+            self._owns_session = True
+        return self.session
+
+    async def _request(self, method: str, path: str, **kwargs) -> AsyncResponse:
+        check_eula(interactive=False)
+        url = path if "://" in path else self.api_url + path
+        if "json" in kwargs:
+            kwargs["data"] = self.codec.dumps(kwargs.pop("json"))
+            kwargs["headers"] = {
+                **(kwargs.get("headers") or {}),
+                "Content-Type": "application/json",
+            }
+        async with self._open().request(method, url, **kwargs) as response:
+            return AsyncResponse(response.status, await response.read(), self.codec)
+
+    def _handle_error(
+        self, resp: AsyncResponse, custom_message: str | None = None
+    ) -> None:
+        handle_error(resp.json(), resp.status_code, self.auth_method, custom_message)
+
+    def _headers(self) -> dict[str, str | None]:
+        return {"Authorization": self.user_info.get_token()}
+
+    async def login_with_credentials(self, email: str, password: str):
+        if self.__logged_in:
+            raise AlreadyLoggedInException("You already logged in")
+        self.channel_cache.invalidate()
+        await self._request("GET", f"{self.base_url}/login")  # Get required cookie
+        creds = {"login": email, "password": password}
+        response = await self._request("POST", "/auth/login", json=creds)
+        if not response.ok:
+            self._handle_error(response)
+        user_data: dict[str, str | dict[str, str]] = response.json()
+        self.user_info = DiscordLoginInfo(
+            token=user_data["token"], uid=user_data["user_id"]
+        )
+        self.channel_ids = ChannelIdMap()
+        self.__logged_in = True
+        return self
+
+    async def login_with_token(self, token):
+        if self.__logged_in:
+            raise AlreadyLoggedInException("You already logged in")
+        resp = await self._request(
+            "GET", "/users/@me", headers={"Authorization": token}
+        )
+        if not resp.ok:
+            self._handle_error(resp, "Invalid Token")
+        self.user_info = DiscordLoginInfo(token=token)
+        self.channel_cache.invalidate()
+        self.channel_ids = ChannelIdMap()
+        self.__logged_in = True
+        return self
+
+    async def get_dms(self, format_type: bool = True):
+        if not self.__logged_in:
+            raise InvalidCredentialsException("You are not logged in")
+        dms = await self.single_flight.do(
+            ("GET", "/users/@me/channels", format_type),
+            lambda: self._fetch_dms(format_type),
+        )
+        return list(dms)
+
+    async def _fetch_dms(self, format_type: bool):
+        response = await self._request(
+            "GET", "/users/@me/channels", headers=self._headers()
+        )
+        if not response.ok:
+            self._handle_error(response)
+        if not format_type:
+            return response.json()
+        dms = self.codec.decode_dms(response.content)
+        self.channel_cache.fill(dms)
+        return dms
+
+    async def send_message_to_channel(
+        self, message: str, channel_id: str, nonce: str | None = None
+    ):
+        if not self.__logged_in:
+            raise InvalidCredentialsException("You need to login first")
+        json_data = {
+            "mobile_network_type": "unknown",
+            "content": message,
+            "nonce": nonce if nonce is not None else make_nonce(),
+            "enforce_nonce": True,
+            "tts": False,
+            "flags": 0,
+        }
+        response = await self._request(
+            "POST",
+            f"/channels/{channel_id}/messages",
+            headers=self._headers(),
+            json=json_data,
+        )
+        if not response.ok:
+            self._handle_error(response)
+        return self
+
+    async def get_channel_id(self, user_id: str) -> str:
+        return (await self.resolve_channel(user_id=user_id)).channel_id
+
+    async def resolve_channel(
+        self, user_id: str | None = None, username: str | None = None
+    ) -> ChannelResolution:
+        if not self.__logged_in:
+            raise InvalidCredentialsException("You need to login first")
+        if (user_id is None) == (username is None):
+            raise ArgumentError("Either user_id or username is required")
+        source = ChannelResolution.CACHE
+        if username is not None:
+            cache = self.channel_cache
+            user = cache.user_by_username(username) if cache.fresh() else None
+            if user is None and not (cache.fresh() and cache.complete):
+                dms = await self.get_dms(True)
+                source = ChannelResolution.DMS
+                user = cache.user_by_username(username)
+                if user is None and not cache.complete:
+                    # Evicted users are only in the listing itself
+                    user = _find_user(dms, lambda other: other.username == username)
+            if user is None:
+                raise UnknownUserException(f"User with username {username} not found")
+            user_id = user.user_id
+        channel_id = self.channel_ids.get(user_id)
+        if channel_id is None:
+            channel = self.channel_cache.dm_channel(user_id)
+            if channel is not None:
+                channel_id = channel.channel_id
+                self.channel_ids.set(user_id, channel_id)
+        if channel_id is None:
+            channel_id = await self._open_channel(user_id)
+            source = ChannelResolution.OPENED
+        return ChannelResolution(channel_id, user_id, source)
+
+    async def _open_channel(self, user_id: str) -> str:
+        return await self.single_flight.do(
+            ("POST", "/users/@me/channels", user_id),
+            lambda: self._create_channel(user_id),
+        )
+
+    async def _create_channel(self, user_id: str) -> str:
+        response = await self._request(
+            "POST",
+            "/users/@me/channels",
+            json={"recipient_id": user_id},
+            headers=self._headers(),
+        )
+        if not response.ok:
+            if response.json().get("code") in UNKNOWN_USER_CODES:
+                raise UnknownUserException(f"User with id {user_id} not found")
+            self._handle_error(response)
+        channel_id = response.json()["id"]
+        self.channel_ids.set(user_id, channel_id)
+        return channel_id
+
+    async def send_message_to_user(self, message: str, user_id: str):
+        return await self._send_resolved(
+            message, await self.resolve_channel(user_id=user_id)
+        )
+
+    async def send_message_to_username(self, message: str, username: str):
+        warnings.warn("Username support is still experimental")
+        try:
+            resolution = await self.resolve_channel(username=username)
+        except UnknownUserException:
+            return None
+        return await self._send_resolved(message, resolution)
+
+    async def _send_resolved(self, message: str, resolution: ChannelResolution):
+        try:
+            return await self.send_message_to_channel(message, resolution.channel_id)
+        except ChannelNotFoundError:
+            if resolution.source == ChannelResolution.OPENED:
+                raise
+            self.channel_ids.discard(resolution.user_id)
+            self.channel_cache.remove(resolution.channel_id)
+            return await self.send_message_to_channel(
+                message, await self._open_channel(resolution.user_id)
+            )
+
+    async def get_channel_info(self, channel_id: str) -> Channel | None:
+        warnings.warn("Channel info is still experimental")
+        return await self._cached_lookup(
+            lambda cache: cache.channel(channel_id),
+            lambda dms: next(
+                (channel for channel in dms if channel.channel_id == channel_id), None
+            ),
+        )
+
+    async def get_user_info_by_id(self, user_id: str) -> OtherUser | None:
+        return await self._cached_lookup(
+            lambda cache: cache.user(user_id),
+            lambda dms: _find_user(dms, lambda user: user.user_id == user_id),
+        )
+
+    async def get_user_info_by_username(self, username: str) -> OtherUser | None:
+        warnings.warn("Username support is still experimental")
+        return await self._cached_lookup(
+            lambda cache: cache.user_by_username(username),
+            lambda dms: _find_user(dms, lambda user: user.username == username),
+        )
+
+    async def _cached_lookup(self, find, scan):
+        if not self.__logged_in:
+            raise InvalidCredentialsException("You are not logged in")
+        dms = None
+        if not self.channel_cache.fresh():
+            dms = await self.get_dms(True)
+        found = find(self.channel_cache)
+        if found is None and not self.channel_cache.complete:
+            found = scan(dms if dms is not None else await self.get_dms(True))
+        return found
+
+
+def _find_user(dms: list[Channel], checker) -> OtherUser | None:
+    for dm in dms:
+        for user in dm.recipients:
+            if checker(user):
+                return user
+    return None
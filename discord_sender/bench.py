@@ -0,0 +1,190 @@
+import cProfile
+import itertools
+import os
+import pstats
+import statistics
+import threading
+import time
+import tracemalloc
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+from .discord import DiscordUser
+from .hooks import RequestInfo, RequestObserver
+from .stub import STUB_TOKEN, StubDiscordServer, synthetic_channels
+from .transport import Transport
+
+OPERATIONS = ("login", "get_dms", "resolve", "send")
+
+
+class Target:
+    def __init__(
+        self,
+        base_url: str,
+        token: str,
+        channel_id: str | None = None,
+        user_id: str | None = None,
+    ):
+        self.base_url: str = base_url
+        self.token: str = token
+        # Without these resolve and send are skipped, nothing is sent by accident
+        self.channel_id: str | None = channel_id
+        self.user_id: str | None = user_id
+
+
+@contextmanager
+def stub_target(dms: int = 100, latency: float = 0.0) -> Iterator[Target]:
+    with StubDiscordServer(channels=synthetic_channels(dms), latency=latency) as server:
+        dm = next(channel for channel in server.channels if channel["type"] == 1)
+        yield Target(server.url, STUB_TOKEN, dm["id"], dm["recipients"][0]["id"])
+
+
+class _RequestCounter(RequestObserver):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests: int = 0
+
+    def on_request_end(self, info: RequestInfo) -> None:
+        with self._lock:
+            self.requests += 1
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    # Interpolated between the closest ranks
+    pos = (len(ordered) - 1) * pct / 100
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+def _resolve(user: DiscordUser, user_id: str):
+    # Cold on purpose, a warm resolution makes no request at all
+    user.channel_cache.invalidate()
+    user.channel_ids.clear()
+    return user.resolve_channel(user_id=user_id)
+
+
+def operations(
+    target: Target, transport: Transport, names=OPERATIONS
+) -> dict[str, Callable]:
+    user = DiscordUser(transport=transport).login_with_token(target.token)
+    messages = itertools.count()
+    available = {
+        "login": lambda: DiscordUser(transport=transport).login_with_token(
+            target.token
+        ),
+        "get_dms": lambda: user.get_dms(True),
+    }
+    if target.user_id is not None:
+        available["resolve"] = lambda: _resolve(user, target.user_id)
+    if target.channel_id is not None:
+        available["send"] = lambda: user.send_message_to_channel(
+            f"discord-sender bench {next(messages)}", target.channel_id
+        )
+    return {name: available[name] for name in names if name in available}
+
+
+def measure(
+    func: Callable,
+    iterations: int = 100,
+    warmup: int = 5,
+    counter: _RequestCounter | None = None,
+) -> dict[str, float]:
+    for _ in range(warmup):
+        func()
+    counter = counter if counter is not None else _RequestCounter()
+    requests = counter.requests
+    timings = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        begin = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - start
+    requests = counter.requests - requests
+    # A separate pass, tracing allocations slows everything down
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(min(iterations, 20)):
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            func()
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    finally:
+        tracemalloc.stop()
+    return {
+        "iterations": iterations,
+        "p50": percentile(timings, 50),
+        "p95": percentile(timings, 95),
+        "p99": percentile(timings, 99),
+        "ops_per_second": iterations / elapsed,
+        "requests_per_second": requests / elapsed,
+        "alloc_peak_bytes": statistics.median(peaks),
+    }
+
+
+def run_bench(
+    target: Target, names=OPERATIONS, iterations: int = 100, warmup: int = 5
+) -> dict[str, dict[str, float]]:
+    counter = _RequestCounter()
+    transport = Transport(base_url=target.base_url)
+    transport.add_observer(counter)
+    try:
+        return {
+            name: measure(func, iterations, warmup, counter)
+            for name, func in operations(target, transport, names).items()
+        }
+    finally:
+        transport.close()
+
+
+def run_profile(
+    target: Target,
+    names=OPERATIONS,
+    iterations: int = 100,
+    warmup: int = 5,
+    output_dir: str | None = None,
+) -> dict[str, pstats.Stats]:
+    results = {}
+    transport = Transport(base_url=target.base_url)
+    try:
+        for name, func in operations(target, transport, names).items():
+            for _ in range(warmup):
+                func()
+            profiler = cProfile.Profile()
+            profiler.enable()
+            for _ in range(iterations):
+                func()
+            profiler.disable()
+            results[name] = pstats.Stats(profiler)
+            if output_dir is None:
+                continue
+            profiler.dump_stats(os.path.join(output_dir, f"{name}.prof"))
+            tracemalloc.start(25)
+            try:
+                for _ in range(iterations):
+                    func()
+                snapshot = tracemalloc.take_snapshot()
+            finally:
+                tracemalloc.stop()
+            snapshot.dump(os.path.join(output_dir, f"{name}.tracemalloc"))
+    finally:
+        transport.close()
+    return results
+
+
+def format_results(results: dict[str, dict[str, float]]) -> str:
+    lines = [
+        f"{'operation':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+        f" {'ops/s':>9} {'req/s':>9} {'peak KiB':>9}"
+    ]
+    for name, result in results.items():
+        lines.append(
+            f"{name:>10} {result['p50'] * 1000:9.3f} {result['p95'] * 1000:9.3f}"
+            f" {result['p99'] * 1000:9.3f} {result['ops_per_second']:9.1f}"
+            f" {result['requests_per_second']:9.1f}"
+            f" {result['alloc_peak_bytes'] / 1024:9.1f}"
+        )
+    return "\n".join(lines)
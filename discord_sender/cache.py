@@ -0,0 +1,185 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from .channel import Channel
+from .config import write_private
+from .other import OtherUser
+
+
+class ChannelCache:
+    def __init__(self, ttl: float = 60.0, max_size: int = 1024, clock=time.monotonic):
+        self.ttl: float = ttl
+        self.max_size: int = max_size
+        self._clock = clock
+        self._channels: OrderedDict[str, Channel] = OrderedDict()
+        self._users: dict[str, OtherUser] = {}
+        self._user_channels: dict[str, set[str]] = {}
+        self._usernames: dict[str, str] = {}
+        self._dms: dict[str, str] = {}
+        self.loaded_at: float | None = None
+        # False once an entry was evicted, so a miss may not be a real miss
+        self.complete: bool = False
+        # True while a gateway listener keeps the entries up to date
+        self.live: bool = False
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._channels)
+
+    def __contains__(self, channel_id: str) -> bool:
+        return channel_id in self._channels
+
+    def fresh(self) -> bool:
+        if self.loaded_at is None:
+            return False
+        if self.live:
+            return True
+        return self._clock() - self.loaded_at < self.ttl
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._channels.clear()
+            self._users.clear()
+            self._user_channels.clear()
+            self._usernames.clear()
+            self._dms.clear()
+            self.loaded_at = None
+            self.complete = False
+
+    def fill(self, channels: list[Channel]) -> None:
+        with self._lock:
+            self.invalidate()
+            self.complete = True
+            for channel in channels:
+                self.add(channel)
+            self.loaded_at = self._clock()
+
+    def add(self, channel: Channel) -> None:
+        with self._lock:
+            if channel.channel_id in self._channels:
+                self.remove(channel.channel_id)
+            self._channels[channel.channel_id] = channel
+            for user in channel.recipients:
+                self._users[user.user_id] = user
+                self._user_channels.setdefault(user.user_id, set()).add(
+                    channel.channel_id
+                )
+                if user.username is not None:
+                    self._usernames[user.username] = user.user_id
+            if channel.type == 1 and len(channel.recipients) == 1:
+                self._dms[channel.recipients[0].user_id] = channel.channel_id
+            while len(self._channels) > self.max_size:
+                self.remove(next(iter(self._channels)))
+                self.complete = False
+
+    def remove(self, channel_id: str) -> Channel | None:
+        with self._lock:
+            channel = self._channels.pop(channel_id, None)
+            if channel is None:
+                return None
+            for user in channel.recipients:
+                channels = self._user_channels.get(user.user_id)
+                if channels is None:
+                    continue
+                channels.discard(channel_id)
+                if self._dms.get(user.user_id) == channel_id:
+                    del self._dms[user.user_id]
+                if not channels:
+                    del self._user_channels[user.user_id]
+                    del self._users[user.user_id]
+                    if self._usernames.get(user.username) == user.user_id:
+                        del self._usernames[user.username]
+            return channel
+
+    def channel(self, channel_id: str) -> Channel | None:
+        with self._lock:
+            channel = self._channels.get(channel_id)
+            if channel is not None:
+                self._channels.move_to_end(channel_id)
+            return channel
+
+    def user(self, user_id: str) -> OtherUser | None:
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is not None:
+                for channel_id in self._user_channels[user_id]:
+                    self._channels.move_to_end(channel_id)
+            return user
+
+    def user_by_username(self, username: str) -> OtherUser | None:
+        with self._lock:
+            user_id = self._usernames.get(username)
+            return None if user_id is None else self.user(user_id)
+
+    def dm_channel(self, user_id: str) -> Channel | None:
+        with self._lock:
+            channel_id = self._dms.get(user_id)
+            return None if channel_id is None else self.channel(channel_id)
+
+
+class ChannelIdMap:
+    def __init__(self, path: str | None = None):
+        self.path: str | None = path
+        self._ids: dict[str, str] = {}
+        self._loaded: bool = path is None
+        self._lock = threading.RLock()
+
+    def __contains__(self, user_id: str) -> bool:
+        with self._lock:
+            self._load()
+            return user_id in self._ids
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._load()
+            return len(self._ids)
+
+    def get(self, user_id: str) -> str | None:
+        with self._lock:
+            self._load()
+            return self._ids.get(user_id)
+
+    def set(self, user_id: str, channel_id: str) -> None:
+        with self._lock:
+            self._load()
+            if self._ids.get(user_id) == channel_id:
+                return
+            self._ids[user_id] = channel_id
+            self._save()
+
+    def discard(self, user_id: str) -> None:
+        with self._lock:
+            self._load()
+            if self._ids.pop(user_id, None) is not None:
+                self._save()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._ids.clear()
+            self._loaded = True
+            self._save()
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict):
+            self._ids.update(
+                {str(user): str(channel) for user, channel in data.items()}
+            )
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+        try:
+            write_private(self.path, self._ids)
+        except OSError:
+            # The on-disk copy is only an optimization
+            pass
@@ -1,8 +1,23 @@
+from collections import Counter
+from typing import NamedTuple
+
 from .other import OtherUser
-from .tools import ziplist
+
+_DELETED = object()
 
 
 class Channel:
+    __slots__ = (
+        "channel_id",
+        "is_in_server",
+        "_recipients",
+        "_raw_recipients",
+        "_to",
+        "type",
+        "name",
+        "channel_type",
+    )
+
     def __init__(
         self,
         channel_id: str,
@@ -13,8 +28,7 @@ class Channel:
     ):
         self.channel_id: str = channel_id
         self.is_in_server: bool = is_in_server
-        self.recipients: list[OtherUser] = recipients
-        self.to = {user.username: user for user in recipients}
+        self.recipients = recipients
         self.type: int = chan_type
         self.name: str = name
         if chan_type == 1:
@@ -24,6 +38,69 @@ class Channel:
         else:
             self.channel_type: str = "unknown"
 
+    @classmethod
+    def from_json(cls, data: dict):
+        return cls.lazy(
+            data["id"], data["recipients"], data["type"], data.get("name", None)
+        )
+
+    @classmethod
+    def lazy(
+        cls,
+        channel_id: str,
+        raw_recipients: list[dict],
+        chan_type: int = 1,
+        name: str | None = None,
+    ):
+        channel = cls(channel_id, [], chan_type=chan_type, name=name)
+        # OtherUser objects are only built if recipients or to is used
+        channel._raw_recipients = raw_recipients
+        channel._recipients = None
+        return channel
+
+    @property
+    def recipients(self) -> list[OtherUser]:
+        if self._recipients is None:
+            self._recipients = [
+                OtherUser.from_json(other) for other in self._raw_recipients
+            ]
+            self._raw_recipients = None
+        elif self._recipients is _DELETED:
+            raise AttributeError("recipients")
+        return self._recipients
+
+    @recipients.setter
+    def recipients(self, recipients: list[OtherUser]):
+        self._recipients = recipients
+        self._raw_recipients = None
+        self._to = None
+
+    @recipients.deleter
+    def recipients(self):
+        self._recipients = _DELETED
+        self._raw_recipients = None
+
+    @property
+    def to(self) -> dict[str | None, OtherUser]:
+        if self._to is None:
+            self._to = {user.username: user for user in self.recipients}
+        elif self._to is _DELETED:
+            raise AttributeError("to")
+        return self._to
+
+    @to.setter
+    def to(self, to: dict[str | None, OtherUser]):
+        self._to = to
+
+    @to.deleter
+    def to(self):
+        self._to = _DELETED
+
+    def recipient_ids(self) -> list[str]:
+        if self._raw_recipients is not None:
+            return [other["id"] for other in self._raw_recipients]
+        return [user.user_id for user in self.recipients]
+
     @staticmethod
     def strict_equality_check(first, second):
         try:
@@ -48,17 +125,49 @@ class Channel:
             if self.is_in_server != other.is_in_server:
                 return False
 
-            if len(self.recipients) != len(other.recipients):
-                return False
-            zipped = ziplist(self.recipients, other.recipients)
-            if len(zipped) != len(other.recipients):
+            if self.type != other.type:
                 return False
-            for recp1, recp2 in zipped:
-                if recp1 != recp2:
-                    return False
 
-            if self.type != other.type:
+            if len(self.recipients) != len(other.recipients):
+                return False
+            # Compared as multisets so the order of recipients does not matter
+            if Counter(self.recipients) != Counter(other.recipients):
                 return False
             return True
         except AttributeError:
             return False
+
+    def __hash__(self) -> int:
+        return hash((self.channel_id, self.is_in_server, self.type))
+
+
+class ChannelDiff(NamedTuple):
+    added: list[Channel]
+    removed: list[Channel]
+    changed: list[tuple[Channel, Channel]]
+
+
+class ChannelResolution(NamedTuple):
+    channel_id: str
+    user_id: str
+    source: str
+
+    # Known without a request, from the remembered ids or the channel cache
+    CACHE = "cache"
+    # Found in a dm listing fetched for this lookup
+    DMS = "dms"
+    # Opened with POST /users/@me/channels
+    OPENED = "open"
+
+
+def diff_channels(old: list[Channel], new: list[Channel]) -> ChannelDiff:
+    before = {channel.channel_id: channel for channel in old}
+    added = []
+    changed = []
+    for channel in new:
+        previous = before.pop(channel.channel_id, None)
+        if previous is None:
+            added.append(channel)
+        elif not Channel.strict_equality_check(previous, channel):
+            changed.append((previous, channel))
+    return ChannelDiff(added, list(before.values()), changed)
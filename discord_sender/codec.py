@@ -0,0 +1,91 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover
+    msgspec = None
+
+from .channel import Channel
+
+
+class JSONCodec:
+    name = "json"
+
+    def loads(self, data: bytes | str):
+        return json.loads(data)
+
+    def dumps(self, obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+    def decode_dms(self, data: bytes | str) -> list[Channel]:
+        return [Channel.from_json(channel) for channel in self.loads(data)]
+
+
+class OrjsonCodec(JSONCodec):
+    name = "orjson"
+
+    def loads(self, data: bytes | str):
+        return orjson.loads(data)
+
+    def dumps(self, obj) -> bytes:
+        return orjson.dumps(obj)
+
+
+if msgspec is not None:
+
+    class _ChannelStruct(msgspec.Struct):
+        id: str
+        type: int
+        # Left as dicts so recipients stay lazy like Channel.from_json
+        recipients: list[dict] = []
+        name: str | None = None
+
+
+class MsgspecCodec(JSONCodec):
+    name = "msgspec"
+
+    def __init__(self):
+        self._decoder = msgspec.json.Decoder()
+        self._encoder = msgspec.json.Encoder()
+        self._dms_decoder = msgspec.json.Decoder(list[_ChannelStruct])
+
+    def loads(self, data: bytes | str):
+        return self._decoder.decode(data)
+
+    def dumps(self, obj) -> bytes:
+        return self._encoder.encode(obj)
+
+    def decode_dms(self, data: bytes | str) -> list[Channel]:
+        # Typed structs skip the intermediate channel dicts
+        return [
+            Channel.lazy(channel.id, channel.recipients, channel.type, channel.name)
+            for channel in self._dms_decoder.decode(data)
+        ]
+
+
+CODECS = {"json": JSONCodec, "orjson": OrjsonCodec, "msgspec": MsgspecCodec}
+
+
+def available_codecs() -> list[str]:
+    names = ["json"]
+    if orjson is not None:
+        names.append("orjson")
+    if msgspec is not None:
+        names.append("msgspec")
+    return names
+
+
+def get_codec(name: str | None = None) -> JSONCodec:
+    if name is None:
+        # The fastest backend that is installed
+        name = available_codecs()[-1]
+    if name not in CODECS:
+        raise ValueError(f"Unknown JSON backend {name}")
+    if name not in available_codecs():
+        raise ImportError(f"The {name} JSON backend is not installed")
+    return CODECS[name]()
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+
+from .discord_exceptions import EulaNotAcceptedError
+
+CONFIG = {
+    "nt": os.path.expanduser("~\\AppData\\Local\\discord-sender"),
+    "other": os.path.expanduser("~/.config/discord-sender"),
+}
+
+_eula_checked = False
+
+
+def config_dir() -> str:
+    return CONFIG["nt"] if os.name == "nt" else CONFIG["other"]
+
+
+def account_key(token: str) -> str:
+    # Never put the token itself in a file name
+    return hashlib.sha256(token.encode()).hexdigest()[:16]
+
+
+def channel_store_path(token: str) -> str:
+    return os.path.join(config_dir(), f"channels-{account_key(token)}.json")
+
+
+def session_path() -> str:
+    return os.path.join(config_dir(), "session.json")
+
+
+def write_private(path: str, data) -> None:
+    # Readable by the owner only, and never left half written
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+    os.chmod(tmp, 0o600)
+    os.replace(tmp, path)
+
+
+def eula_path() -> str:
+    return os.path.join(config_dir(), ".eulaaccepted")
+
+
+def accept_eula() -> None:
+    os.makedirs(config_dir(), exist_ok=True)
+    with open(eula_path(), "a"):
+        pass
+
+
+def _term_warning():
+    if (
+        not input(
+            "This program breaks Discords TOS.\nPress yes to aknowledge all responsibility\nThis will be the "
+            "only time this is asked. [N/y]"
+        )
+        .lower()
+        .startswith("y")
+    ):
+        sys.exit(0)
+    accept_eula()
+
+
+def check_eula(interactive: bool = True) -> None:
+    # Runs before the first request instead of on import, the answer is cached
+    global _eula_checked
+    if _eula_checked or "--accept-eula" in sys.argv:
+        return
+    if not os.path.exists(eula_path()):
+        # A prompt would block a worker thread or the event loop and sys.exit
+        # would only end that thread
+        if not interactive or threading.current_thread() is not threading.main_thread():
+            raise EulaNotAcceptedError(
+                'The eula was not accepted yet, run "python -m discord_sender '
+                '--accept-eula" or make the first request from the main thread'
+            )
+        try:
+            _term_warning()
+        except Exception:
+            print(
+                "You cannot use this program until you have accepted the eula but there was an error writing the "
+                'config file.\n To continue, please run "python -m discord_sender --accept-eula" as '
+                "administrator/root"
+            )
+            sys.exit(1)
+    _eula_checked = True
@@ -0,0 +1,87 @@
+import threading
+import time
+
+import requests
+
+
+class CircuitOpenError(requests.ConnectionError):
+    pass
+
+
+class ConnectivityTracker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 3,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        clock=time.monotonic,
+    ):
+        self.failure_threshold: int = failure_threshold
+        self.initial_backoff: float = backoff
+        self.max_backoff: float = max_backoff
+        self._clock = clock
+        self.failures: int = 0
+        self.backoff: float = backoff
+        self.state: str = self.CLOSED
+        self.opened_at: float | None = None
+        self._lock = threading.RLock()
+
+    def healthy(self) -> bool:
+        return self.state == self.CLOSED
+
+    def before_request(self) -> None:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN:
+                if self._clock() - self.opened_at < self.backoff:
+                    raise CircuitOpenError("Internet not connected")
+                # Let the next real request through as the probe
+                self.state = self.HALF_OPEN
+                return
+            # Only one probe at a time while half open
+            raise CircuitOpenError("Internet not connected")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.backoff = self.initial_backoff
+            self.state = self.CLOSED
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN:
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+                self._open()
+            elif self.failures >= self.failure_threshold:
+                self._open()
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self.opened_at = self._clock()
+
+    def reset(self) -> None:
+        self.record_success()
+
+    def call(self, func, *args, **kwargs):
+        self.before_request()
+        try:
+            result = func(*args, **kwargs)
+            self.record_success()
+            return result
+        except CircuitOpenError:
+            raise
+        except requests.ConnectionError:
+            self.record_failure()
+            raise
+        finally:
+            # A probe that ended any other way (even KeyboardInterrupt) frees its slot
+            with self._lock:
+                if self.state == self.HALF_OPEN:
+                    self._open()
@@ -0,0 +1,45 @@
+import time
+
+from .discord_exceptions import DeadlineExceeded
+
+
+class Deadline:
+    def __init__(self, timeout: float, clock=time.monotonic):
+        self.timeout: float = timeout
+        self._clock = clock
+        self.expires_at: float = clock() + timeout
+
+    @classmethod
+    def coerce(cls, deadline: "Deadline | float | None") -> "Deadline | None":
+        # Public methods take seconds or a Deadline shared with the caller
+        if deadline is None or isinstance(deadline, Deadline):
+            return deadline
+        return cls(deadline)
+
+    def remaining(self) -> float:
+        return max(self.expires_at - self._clock(), 0.0)
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self) -> None:
+        if self.expired():
+            raise DeadlineExceeded(f"Deadline of {self.timeout}s exceeded")
+
+    def ensure(self, seconds: float) -> None:
+        # Fail now instead of sleeping into a deadline that will pass anyway
+        if seconds >= self.remaining():
+            raise DeadlineExceeded(
+                f"Deadline of {self.timeout}s would be exceeded by waiting {seconds:.3f}s"
+            )
+
+    def clamp(
+        self, timeout: float | tuple[float, float] | None
+    ) -> float | tuple[float, float]:
+        self.check()
+        remaining = self.remaining()
+        if timeout is None:
+            return remaining
+        if isinstance(timeout, tuple):
+            return tuple(min(part, remaining) for part in timeout)
+        return min(timeout, remaining)
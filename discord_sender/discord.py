@@ -1,13 +1,36 @@
 import copy
 import functools
+import json
+import threading
+import time
 import warnings
+from collections.abc import Iterator
+from concurrent.futures import Future
 
 import requests
 
-from .channel import Channel
+from .cache import ChannelCache, ChannelIdMap
+from .channel import Channel, ChannelResolution
+from .config import channel_store_path, session_path, write_private
+from .connection import ConnectivityTracker
+from .deadline import Deadline
 from .discord_exceptions import *
+from .gateway import GatewayListener
+from .hooks import RequestObserver
 from .info import DiscordLoginInfo
+from .message import Message
+from .multipart import MultipartBody, attachment_name
 from .other import OtherUser
+from .ratelimit import Route
+from .retry import RetryPolicy
+from .sender import SendQueue
+from .singleflight import SingleFlight
+from .tools import iter_json_array, make_nonce, read_ahead
+from .transport import Transport
+
+MESSAGE_PAGE_SIZE = 100
+# Unknown User and Invalid Recipient(s), how opening a dm with nobody fails
+UNKNOWN_USER_CODES = (10013, 50033)
 
 
 def internet_connection():
@@ -19,22 +42,141 @@ def internet_connection():
         return False  # pragma: no mutate
 
 
-def patch_get(get):
+def patch_get(get, tracker: ConnectivityTracker | None = None):
+    tracker = tracker if tracker is not None else ConnectivityTracker()
+
     @functools.wraps(get)  # pragma: no mutate
     def wrapper(*args, **kwargs):
-        if not internet_connection():
-            raise requests.ConnectionError("Internet not connected")  # pragma: no mutate
-        return get(*args, **kwargs)
+        return tracker.call(get, *args, **kwargs)
 
     return wrapper
 
 
+def _flatten(pages: Iterator[list]) -> Iterator:
+    for page in pages:
+        yield from page
+
+
+def parse_dms(
+    json: list[dict[str, str | int | list[dict[str, int | str | None | bool]]]]
+) -> list[Channel]:
+    return [Channel.from_json(channel) for channel in json]
+
+
+def handle_error(
+    json_data: dict,
+    status_code: int,
+    auth_method: str | None = None,
+    custom_message: str | None = None,
+) -> None:
+    if json_data.get("captcha_key") == ['captcha-required']:
+        errcde = "Please login in a browser first and complete the captcha"
+        if auth_method == "cred":
+            errcde += "\nor try token authentication."
+        raise CaptchaError(errcde)
+    if status_code == 429:
+        raise RateLimitedError(
+            f"Rate limited by discord. Json data: {json_data}",
+            json_data.get("retry_after"),
+        )
+    try:
+        error: dict[str, str] = json_data["errors"]["login"]["_errors"][0]
+        if error["code"] == "INVALID_LOGIN":
+            raise InvalidCredentialsException(error["message"])
+        else:
+            raise requests.RequestException(
+                f"Unknown error code from discord. Json data: {json_data}"
+            )
+    except KeyError:
+        pass
+    try:
+        error = json_data
+        if error["code"] == 10003:
+            raise ChannelNotFoundError(f"Channel not found")
+        elif status_code == 401 and error["code"] == 0:
+            raise InvalidCredentialsException(
+                error["message"] if not custom_message else custom_message
+            )
+        elif error["code"] == 50001:
+            raise InvalidCredentialsException(
+                "You do not have permission to send a message in this channel"
+            )
+        else:
+            raise requests.RequestException(
+                f"Unknown error code from discord. Json data: {json_data}"
+            )
+    except KeyError:
+        raise requests.RequestException(
+            f"Unknown error code from discord. Json data: {json_data}"
+        )
+
+
 class DiscordUser:
-    def __init__(self):
+    def __init__(
+        self,
+        cache_ttl: float = 60.0,
+        cache_size: int = 1024,
+        persist_channel_ids: bool | str = False,
+        transport: Transport | None = None,
+        retry_policy: RetryPolicy | None = None,
+        send_queue_size: int = 1000,
+    ):
         self.user_info: DiscordLoginInfo | None = None
         self.__logged_in: bool = False
-        self.session: requests.Session | None = None
+        self.transport: Transport = transport if transport is not None else Transport()
         self.auth_method: str | None = None
+        self.connectivity: ConnectivityTracker = self.transport.connectivity
+        self.channel_cache: ChannelCache = ChannelCache(cache_ttl, cache_size)
+        self.persist_channel_ids: bool | str = persist_channel_ids
+        self.channel_ids: ChannelIdMap = ChannelIdMap()
+        self.retry_policy: RetryPolicy = (
+            retry_policy if retry_policy is not None else RetryPolicy()
+        )
+        self.send_queue: SendQueue = SendQueue(send_queue_size)
+        # Concurrent identical reads share one request
+        self.single_flight: SingleFlight = SingleFlight()
+        # False after load_session until a request proves the token still works
+        self.session_verified: bool = True
+        self._login_lock = threading.RLock()
+        self.gateway: GatewayListener | None = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self, wait: bool = True) -> None:
+        if self.gateway is not None:
+            self.gateway.stop()
+            self.gateway = None
+        self.send_queue.close(wait)
+        self.transport.close()
+
+    @property
+    def session(self) -> requests.Session | None:
+        return self.transport.session
+
+    @session.setter
+    def session(self, session: requests.Session | None):
+        self.transport.session = session
+
+    def add_observer(self, observer: RequestObserver) -> RequestObserver:
+        return self.transport.add_observer(observer)
+
+    def remove_observer(self, observer: RequestObserver) -> None:
+        self.transport.remove_observer(observer)
+
+    def listen(self, url: str | None = None, **kwargs) -> GatewayListener:
+        if not self.__logged_in:
+            raise InvalidCredentialsException("You are not logged in")
+        if self.gateway is None:
+            # Channel events keep the cache current, dms are only listed on connect
+            self.gateway = GatewayListener(self, url, **kwargs).start()
+        return self.gateway
+
+    def rate_limits(self) -> dict:
+        return self.transport.rate_limiter.state()
 
     def logged_in(self) -> bool:
         return self.__logged_in
@@ -43,7 +185,9 @@ class DiscordUser:
         warnings.warn("This method snould not be used outside of tests.")
         self.__logged_in = logged_in
 
-    def get_dms(self, format_type: bool | int = True):
+    def get_dms(
+        self, format_type: bool | int = True, deadline: Deadline | float | None = None
+    ):
         if isinstance(format_type, int) and not isinstance(format_type, bool):
             warnings.warn(
                 "Passing int to get_dms is Deprecated and will soon be removed",
@@ -52,114 +196,296 @@ class DiscordUser:
             format_type = False if format_type == 1 else True
         if not self.__logged_in:
             raise InvalidCredentialsException("You are not logged in")
+        deadline = Deadline.coerce(deadline)
+        dms = self.single_flight.do(
+            ("GET", "/users/@me/channels", format_type),
+            lambda: self._fetch_dms(format_type, deadline),
+            deadline,
+        )
+        # Callers that shared a request each get their own list
+        return list(dms)
+
+    def _fetch_dms(self, format_type: bool, deadline: Deadline | None):
         heads = {"Authorization": self.user_info.get_token()}
-        response = self.session.get(
-            "https://discord.com/api/v9/users/@me/channels", headers=heads
+        response = self.transport.request(
+            "GET",
+            "/users/@me/channels",
+            retry=self.retry_policy,
+            deadline=deadline,
+            headers=heads,
         )
         if not response.ok:
             self._handle_error(response)
         if not format_type:
-            return response.json()
-        dms = []
-        json: list[dict[str, str | int | list[dict[str, int | str | None | bool]]]] = (
-            response.json()
-        )
-        for channel in json:
-            dms.append(
-                Channel(
-                    channel["id"],
-                    [
-                        OtherUser(
-                            user_id=other["id"],
-                            global_name=other.get("global_name"),
-                            username=other.get("username"),
-                            is_bot=other.get("bot", False),
-                        )
-                        for other in channel["recipients"]
-                    ],
-                    chan_type=channel["type"],
-                    name=channel.get("name", None),
-                )
-            )
+            return self.transport.decode(response)
+        dms = self.transport.decode_dms(response)
+        self.channel_cache.fill(dms)
         return dms
 
+    def iter_dms(
+        self, chunk_size: int = 16384, deadline: Deadline | float | None = None
+    ) -> Iterator[Channel]:
+        if not self.__logged_in:
+            raise InvalidCredentialsException("You are not logged in")
+        deadline = Deadline.coerce(deadline)
+        heads = {"Authorization": self.user_info.get_token()}
+        response = self.transport.request(
+            "GET",
+            "/users/@me/channels",
+            retry=self.retry_policy,
+            deadline=deadline,
+            headers=heads,
+            stream=True,
+        )
+        try:
+            if not response.ok:
+                self._handle_error(response)
+            chunks = response.iter_content(chunk_size)
+            if deadline is not None:
+                chunks = _until(deadline, chunks)
+            for channel in iter_json_array(chunks):
+                yield Channel.from_json(channel)
+        finally:
+            response.close()
+
+    def iter_messages(
+        self,
+        channel_id: str,
+        before: str | None = None,
+        after: str | None = None,
+        limit: int | None = None,
+        prefetch: int = 2,
+        deadline: Deadline | float | None = None,
+    ) -> Iterator[Message]:
+        # Not a generator itself, so the deadline starts with the call
+        if not self.__logged_in:
+            raise InvalidCredentialsException("You are not logged in")
+        pages = self._message_pages(
+            channel_id, before, after, limit, Deadline.coerce(deadline)
+        )
+        if prefetch > 0:
+            # The next pages download while the caller works on this one
+            pages = read_ahead(pages, prefetch)
+        return _flatten(pages)
+
+    def _message_pages(
+        self,
+        channel_id: str,
+        before: str | None,
+        after: str | None,
+        limit: int | None,
+        deadline: Deadline | None,
+    ) -> Iterator[list[Message]]:
+        heads = {"Authorization": self.user_info.get_token()}
+        route = Route("GET", "/channels/{channel_id}/messages", channel_id=channel_id)
+        # Only after given pages oldest first, otherwise newest first from before
+        forward = after is not None and before is None
+        while limit is None or limit > 0:
+            size = MESSAGE_PAGE_SIZE if limit is None else min(limit, MESSAGE_PAGE_SIZE)
+            params = {"limit": size}
+            if forward:
+                params["after"] = after
+            elif before is not None:
+                params["before"] = before
+            response = self.transport.request(
+                route,
+                retry=self.retry_policy,
+                deadline=deadline,
+                headers=heads,
+                params=params,
+            )
+            if not response.ok:
+                self._handle_error(response)
+            data = self.transport.decode(response)
+            page = [Message.from_json(message) for message in data]
+            if forward:
+                page.reverse()
+                if page:
+                    after = page[-1].message_id
+            else:
+                if page:
+                    before = page[-1].message_id
+                if after is not None:
+                    page = [
+                        message
+                        for message in page
+                        if int(message.message_id) > int(after)
+                    ]
+            if limit is not None:
+                page = page[:limit]
+                limit -= len(page)
+            if page:
+                yield page
+            if len(data) < size or len(page) < len(data):
+                return
+
     def _handle_error(
         self, resp: requests.Response, custom_message: str | None = None
     ) -> None:
-        json_data = resp.json()
-        if json_data.get("captcha_key") == ['captcha-required']:
-            errcde = "Please login in a browser first and complete the captcha"
-            if self.auth_method == "cred":
-                errcde += "\nor try token authentication."
-            raise CaptchaError(errcde)
+        if resp.status_code == 401 and not self.session_verified:
+            self._revalidate()
+        start = time.perf_counter()
         try:
-            error: dict[str, str] = json_data["errors"]["login"]["_errors"][0]
-            if error["code"] == "INVALID_LOGIN":
-                raise InvalidCredentialsException(error["message"])
-            else:
-                raise requests.RequestException(
-                    f"Unknown error code from discord. Json data: {json_data}"
+            handle_error(
+                self.transport.decode(resp),
+                resp.status_code,
+                self.auth_method,
+                custom_message,
+            )
+        except Exception as error:
+            duration = time.perf_counter() - start
+            for observer in self.transport.observers:
+                observer.on_error_handled(resp.status_code, error, duration)
+            raise
+
+    def login_with_credentials(
+        self, email: str, password: str, deadline: Deadline | float | None = None
+    ):
+        deadline = Deadline.coerce(deadline)
+        with self._login_lock:
+            if self.__logged_in:
+                raise AlreadyLoggedInException("You already logged in")
+            self.channel_cache.invalidate()
+            # Get required cookie
+            self.transport.request(
+                "GET", f"{self.transport.base_url}/login", deadline=deadline
+            )
+            creds = {"login": email, "password": password}
+            response: requests.Response = self.transport.request(
+                "POST", "/auth/login", deadline=deadline, headers={}, json=creds
+            )
+            if not response.ok:
+                self._handle_error(response)
+            user_data: dict[str, str | dict[str, str]] = self.transport.decode(response)
+            self.user_info = DiscordLoginInfo(
+                token=user_data["token"], uid=user_data["user_id"]
+            )
+            self.__logged_in = True
+            self.session_verified = True
+            self._load_channel_ids()
+            return self
+
+    def login_with_token(self, token, deadline: Deadline | float | None = None):
+        with self._login_lock:
+            if self.__logged_in:
+                raise AlreadyLoggedInException("You already logged in")
+            resp = self.transport.request(
+                "GET",
+                "/users/@me",
+                deadline=Deadline.coerce(deadline),
+                headers={"Authorization": token},
+            )
+            if not resp.ok:
+                self._handle_error(resp, "Invalid Token")
+            me = self.transport.decode(resp)
+            self.user_info = DiscordLoginInfo(
+                token=token, uid=me.get("id") if isinstance(me, dict) else None
+            )
+            self.__logged_in = True
+            self.session_verified = True
+            self.channel_cache.invalidate()
+            self._load_channel_ids()
+            return self
+
+    def save_session(self, path: str | None = None) -> str:
+        if not self.__logged_in:
+            raise InvalidCredentialsException("You are not logged in")
+        path = path or session_path()
+        cookies = []
+        if self.session is not None:
+            cookies = [
+                {
+                    "name": cookie.name,
+                    "value": cookie.value,
+                    "domain": cookie.domain,
+                    "path": cookie.path,
+                    "expires": cookie.expires,
+                    "secure": cookie.secure,
+                }
+                for cookie in self.session.cookies
+            ]
+        write_private(
+            path,
+            {
+                "base_url": self.transport.base_url,
+                "token": self.user_info.get_token(),
+                "uid": self.user_info.uid,
+                "auth_method": self.auth_method,
+                "cookies": cookies,
+            },
+        )
+        return path
+
+    def load_session(self, path: str | None = None) -> bool:
+        with self._login_lock:
+            if self.__logged_in:
+                raise AlreadyLoggedInException("You already logged in")
+            try:
+                with open(path or session_path()) as f:
+                    data = json.load(f)
+                token = data["token"]
+            except (OSError, ValueError, KeyError, TypeError):
+                return False
+            if not token or data.get("base_url") != self.transport.base_url:
+                return False
+            session = self.transport.open()
+            for cookie in data.get("cookies", []):
+                session.cookies.set(
+                    cookie["name"],
+                    cookie["value"],
+                    domain=cookie["domain"],
+                    path=cookie["path"],
+                    expires=cookie["expires"],
+                    secure=cookie["secure"],
                 )
-        except KeyError:
-            pass
-        try:
-            error = json_data
-            if error["code"] == 10003:
-                raise ChannelNotFoundError(f"Channel not found")
-            elif resp.status_code == 401 and error["code"] == 0:
+            self.user_info = DiscordLoginInfo(token=token, uid=data.get("uid"))
+            self.auth_method = data.get("auth_method")
+            self.__logged_in = True
+            self.session_verified = False
+            self.channel_cache.invalidate()
+            self._load_channel_ids()
+            return True
+
+    def _revalidate(self) -> None:
+        with self._login_lock:
+            if self.session_verified:
+                # Another thread got here first
+                return
+            if not self.__logged_in:
                 raise InvalidCredentialsException(
-                    error["message"] if not custom_message else custom_message
+                    "The saved session has expired, please login again"
                 )
-            elif error["code"] == 50001:
+            resp = self.transport.request(
+                "GET",
+                "/users/@me",
+                headers={"Authorization": self.user_info.get_token()},
+            )
+            if resp.status_code == 401:
+                self.__logged_in = False
+                self.user_info = None
                 raise InvalidCredentialsException(
-                    "You do not have permission to send a message in this channel"
+                    "The saved session has expired, please login again"
                 )
-            else:
-                raise requests.RequestException(
-                    f"Unknown error code from discord. Json data: {json_data}"
-                )
-        except KeyError:
-            raise requests.RequestException(
-                f"Unknown error code from discord. Json data: {json_data}"
-            )
-
-    def login_with_credentials(self, email: str, password: str):
-        if self.__logged_in:
-            raise AlreadyLoggedInException("You already logged in")
-        self.session = requests.Session()
-        self.session.get = patch_get(self.session.get)  # Fix internet not connected
-        self.session.get("https://discord.com/login")  # Get required cookie
-        creds = {"login": email, "password": password}
-        response: requests.Response = self.session.post(
-            "https://discord.com/api/v9/auth/login", headers={}, json=creds
-        )
-        if not response.ok:
-            self._handle_error(response)
-        user_data: dict[str, str | dict[str, str]] = response.json()
-        self.user_info = DiscordLoginInfo(
-            token=user_data["token"], uid=user_data["user_id"]
-        )
-        self.__logged_in = True
-        return self
+            self.session_verified = resp.ok
 
-    def login_with_token(self, token):
-        if self.__logged_in:
-            raise AlreadyLoggedInException("You already logged in")
-        resp = requests.get(
-            "https://discord.com/api/v9/users/@me", headers={"Authorization": token}
-        )
-        if not resp.ok:
-            self._handle_error(resp, "Invalid Token")
-        self.user_info = DiscordLoginInfo(token=token)
-        self.__logged_in = True
-        self.session = requests.Session()
-        self.session.get = patch_get(self.session.get)
-        return self
+    def _load_channel_ids(self):
+        path = self.persist_channel_ids
+        if path is True:
+            path = channel_store_path(self.user_info.get_token())
+        self.channel_ids = ChannelIdMap(path or None)
 
     def login_with_cookie(self, cookie: None):
         raise NotImplementedError("Cookie not implemented yet")  # TODO: Figure this out
 
-    def send_message_to_channel(self, message: str, channel_id: str):
+    def send_message_to_channel(
+        self,
+        message: str,
+        channel_id: str,
+        nonce: str | None = None,
+        deadline: Deadline | float | None = None,
+        files: list | None = None,
+        progress=None,
+    ):
         if not self.__logged_in:
             raise InvalidCredentialsException("You need to login first")
         if not self.user_info.get_token():
@@ -170,71 +496,246 @@ class DiscordUser:
         json_data = {
             "mobile_network_type": "unknown",
             "content": message,
-            "nonce": "0",  # For some reason this works as intended??
-            # https://github.com/discord/discord-api-docs/issues/5607
+            # With enforce_nonce discord returns the already created message
+            # for a repeated nonce, so retries can not post duplicates
+            "nonce": nonce if nonce is not None else make_nonce(),
+            "enforce_nonce": True,
             "tts": False,
             "flags": 0,
         }
-        response = self.session.post(
-            f"https://discord.com/api/v9/channels/{channel_id}/messages",
-            headers=heads,
-            data=json_data,
-        )
+        route = Route("POST", "/channels/{channel_id}/messages", channel_id=channel_id)
+        if not files:
+            response = self.transport.request(
+                route,
+                retry=self.retry_policy,
+                deadline=Deadline.coerce(deadline),
+                headers=heads,
+                json=json_data,
+            )
+        else:
+            json_data["attachments"] = [
+                {"id": index, "filename": attachment_name(source, index)}
+                for index, source in enumerate(files)
+            ]
+            payload = self.transport.codec.dumps(json_data)
+            # Files are read in chunks while sending, never loaded whole
+            with MultipartBody(
+                [("payload_json", payload, "application/json")], files, progress
+            ) as body:
+                response = self.transport.request(
+                    route,
+                    retry=self.retry_policy,
+                    deadline=Deadline.coerce(deadline),
+                    headers={**heads, "Content-Type": body.content_type},
+                    data=body,
+                )
         if not response.ok:
             self._handle_error(response)
         return self
 
-    def get_channel_id(self, user_id: str) -> str:
+    def send_message_to_channel_async(
+        self,
+        message: str,
+        channel_id: str,
+        block: bool = True,
+        timeout: float | None = None,
+        deadline: Deadline | float | None = None,
+    ) -> Future:
         if not self.__logged_in:
             raise InvalidCredentialsException("You need to login first")
+        return self.send_queue.submit(
+            self.send_message_to_channel,
+            message,
+            channel_id,
+            # Fixed now so the queued send keeps its identity
+            nonce=make_nonce(),
+            # Started now, time spent in the queue counts against it
+            deadline=Deadline.coerce(deadline),
+            block=block,
+            timeout=timeout,
+        )
+
+    enqueue_send = send_message_to_channel_async
+
+    def get_channel_id(
+        self, user_id: str, deadline: Deadline | float | None = None
+    ) -> str:
+        return self.resolve_channel(user_id=user_id, deadline=deadline).channel_id
+
+    def resolve_channel(
+        self,
+        user_id: str | None = None,
+        username: str | None = None,
+        deadline: Deadline | float | None = None,
+    ) -> ChannelResolution:
+        deadline = Deadline.coerce(deadline)
+        if not self.__logged_in:
+            raise InvalidCredentialsException("You need to login first")
+        if (user_id is None) == (username is None):
+            raise ArgumentError("Either user_id or username is required")
+        source = ChannelResolution.CACHE
+        if username is not None:
+            cache = self.channel_cache
+            user = cache.user_by_username(username) if cache.fresh() else None
+            if user is None and not (cache.fresh() and cache.complete):
+                dms = self.get_dms(True, deadline)
+                source = ChannelResolution.DMS
+                user = cache.user_by_username(username)
+                if user is None and not cache.complete:
+                    # Evicted users are only in the listing itself
+                    user = self._do_user_check(
+                        lambda other: other.username == username, dms
+                    )
+            if user is None:
+                raise UnknownUserException(f"User with username {username} not found")
+            user_id = user.user_id
+        channel_id = self.channel_ids.get(user_id)
+        if channel_id is None:
+            # Dm channel ids never change, so even a stale cache entry is good
+            channel = self.channel_cache.dm_channel(user_id)
+            if channel is not None:
+                channel_id = channel.channel_id
+                self.channel_ids.set(user_id, channel_id)
+        if channel_id is None:
+            channel_id = self._open_channel(user_id, deadline)
+            source = ChannelResolution.OPENED
+        resolution = ChannelResolution(channel_id, user_id, source)
+        for observer in self.transport.observers:
+            observer.on_channel_resolved(resolution)
+        return resolution
+
+    def _open_channel(self, user_id: str, deadline: Deadline | None = None) -> str:
+        return self.single_flight.do(
+            ("POST", "/users/@me/channels", user_id),
+            lambda: self._create_channel(user_id, deadline),
+            deadline,
+        )
+
+    def _create_channel(self, user_id: str, deadline: Deadline | None) -> str:
         data = {"recipient_id": user_id}
         headers: dict[str, str | None] = {"authorization": self.user_info.get_token()}
-        response = requests.post(
-            f"https://discord.com/api/v9/users/@me/channels", json=data, headers=headers
+        response = self.transport.request(
+            "POST",
+            "/users/@me/channels",
+            retry=self.retry_policy,
+            deadline=deadline,
+            json=data,
+            headers=headers,
         )
-        try:
-            return response.json()["id"]
-        except KeyError:
-            raise UnknownUserException(f"User with id {user_id} not found")
+        if not response.ok:
+            if self.transport.decode(response).get("code") in UNKNOWN_USER_CODES:
+                raise UnknownUserException(f"User with id {user_id} not found")
+            self._handle_error(response)
+        channel_id = self.transport.decode(response)["id"]
+        self.channel_ids.set(user_id, channel_id)
+        return channel_id
 
-    def send_message_to_user(self, message: str, user_id: str):
-        return self.send_message_to_channel(message, self.get_channel_id(user_id))
+    def send_message_to_user(
+        self,
+        message: str,
+        user_id: str,
+        deadline: Deadline | float | None = None,
+        files: list | None = None,
+        progress=None,
+    ):
+        deadline = Deadline.coerce(deadline)
+        resolution = self.resolve_channel(user_id=user_id, deadline=deadline)
+        return self._send_resolved(
+            message, resolution, deadline=deadline, files=files, progress=progress
+        )
 
-    def send_message_to_username(self, message: str, username: str):
+    def send_message_to_username(
+        self,
+        message: str,
+        username: str,
+        deadline: Deadline | float | None = None,
+        files: list | None = None,
+        progress=None,
+    ):
         warnings.warn("Username support is still experimental")
-        dms: list[Channel] = self.get_dms(True)
-        for dm in dms:
-            to: OtherUser | list[OtherUser] = dm.recipients
-            if isinstance(to, OtherUser):
-                to: list[OtherUser] = [to]
-            for user in to:
-                if user.username == username:
-                    return self.send_message_to_user(message, user.user_id)
+        deadline = Deadline.coerce(deadline)
+        try:
+            resolution = self.resolve_channel(username=username, deadline=deadline)
+        except UnknownUserException:
+            return None
+        return self._send_resolved(
+            message, resolution, deadline=deadline, files=files, progress=progress
+        )
 
-    def get_channel_info(self, channel_id: str):
+    def _send_resolved(self, message: str, resolution: ChannelResolution, **kwargs):
+        try:
+            return self.send_message_to_channel(
+                message, resolution.channel_id, **kwargs
+            )
+        except ChannelNotFoundError:
+            if resolution.source == ChannelResolution.OPENED:
+                raise
+            # The remembered channel is gone, open a new one
+            self.channel_ids.discard(resolution.user_id)
+            self.channel_cache.remove(resolution.channel_id)
+            return self.send_message_to_channel(
+                message,
+                self._open_channel(resolution.user_id, kwargs.get("deadline")),
+                **kwargs,
+            )
+
+    def get_channel_info(
+        self, channel_id: str, deadline: Deadline | float | None = None
+    ):
         warnings.warn("Channel info is still experimental")
-        channels: list[Channel] = self.get_dms(True)
-        for channel in channels:
-            if channel.channel_id == channel_id:
-                return channel
+        return self._cached_lookup(
+            lambda cache: cache.channel(channel_id),
+            lambda dms: next(
+                (channel for channel in dms if channel.channel_id == channel_id), None
+            ),
+            deadline,
+        )
 
-    def get_user_info_by_id(self, user_id: str):
+    def get_user_info_by_id(
+        self, user_id: str, deadline: Deadline | float | None = None
+    ):
         warnings.warn(
             "It is recommended to use get_dms to get the info of a user as this function calls that "
             "internally"
         )
-        return self._do_user_check(lambda user: user.user_id == user_id)
+        return self._cached_lookup(
+            lambda cache: cache.user(user_id),
+            lambda dms: self._do_user_check(lambda user: user.user_id == user_id, dms),
+            deadline,
+        )
 
-    def get_user_info_by_username(self, username: str):
+    def get_user_info_by_username(
+        self, username: str, deadline: Deadline | float | None = None
+    ):
         warnings.warn("Username support is still experimental")
         warnings.warn(
             "It is recommended to use get_dms to get the info of a user as this function calls that "
             "internally"
         )
-        return self._do_user_check(lambda user: user.username == username)
+        return self._cached_lookup(
+            lambda cache: cache.user_by_username(username),
+            lambda dms: self._do_user_check(
+                lambda user: user.username == username, dms
+            ),
+            deadline,
+        )
 
-    def _do_user_check(self, checker):
-        dms: list[Channel] = self.get_dms(True)
+    def _cached_lookup(self, find, scan, deadline: Deadline | float | None = None):
+        if not self.__logged_in:
+            raise InvalidCredentialsException("You are not logged in")
+        deadline = Deadline.coerce(deadline)
+        dms = None
+        if not self.channel_cache.fresh():
+            dms = self.get_dms(True, deadline)
+        found = find(self.channel_cache)
+        if found is None and not self.channel_cache.complete:
+            # Evicted entries are only recoverable from a full listing
+            found = scan(dms if dms is not None else self.get_dms(True, deadline))
+        return found
+
+    def _do_user_check(self, checker, dms: list[Channel] | None = None):
+        if dms is None:
+            dms = self.get_dms(True)
         for dm in dms:
             to: OtherUser | list[OtherUser] = dm.recipients
             if isinstance(to, OtherUser):
@@ -242,3 +743,9 @@ class DiscordUser:
             for user in to:
                 if checker(user):
                     return user
+
+
+def _until(deadline: Deadline, chunks: Iterator[bytes]) -> Iterator[bytes]:
+    for chunk in chunks:
+        deadline.check()
+        yield chunk
@@ -20,3 +20,17 @@ class UnknownUserException(Exception):
 
 class AlreadyLoggedInException(Exception):
     pass
+
+
+class EulaNotAcceptedError(Exception):
+    pass
+
+
+class RateLimitedError(Exception):
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after: float | None = retry_after
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
@@ -0,0 +1,376 @@
+import base64
+import hashlib
+import os
+import random
+import socket
+import ssl
+import threading
+import time
+from collections.abc import Iterable
+from urllib.parse import urlsplit
+
+from .channel import Channel
+from .discord_exceptions import InvalidCredentialsException
+from .retry import RetryPolicy
+
+GATEWAY_QUERY = "?v=9&encoding=json"
+_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+DISPATCH = 0
+HEARTBEAT = 1
+IDENTIFY = 2
+RECONNECT = 7
+INVALID_SESSION = 9
+HELLO = 10
+HEARTBEAT_ACK = 11
+
+CHANNEL_CREATE = "CHANNEL_CREATE"
+CHANNEL_UPDATE = "CHANNEL_UPDATE"
+CHANNEL_DELETE = "CHANNEL_DELETE"
+# Reconnecting does not help with these close codes
+FATAL_CLOSE_CODES = frozenset({4004, 4010, 4011, 4012, 4013, 4014})
+
+
+class GatewayClosed(ConnectionError):
+    def __init__(self, code: int | None, reason: str = ""):
+        super().__init__(f"Gateway closed with code {code}: {reason}")
+        self.code: int | None = code
+        self.reason: str = reason
+
+
+def accept_key(key: str) -> str:
+    return base64.b64encode(hashlib.sha1((key + _GUID).encode()).digest()).decode()
+
+
+def _mask(data: bytes, key: bytes) -> bytes:
+    repeated = (key * (len(data) // 4 + 1))[: len(data)]
+    masked = int.from_bytes(data, "big") ^ int.from_bytes(repeated, "big")
+    return masked.to_bytes(len(data), "big")
+
+
+def encode_frame(opcode: int, payload: bytes, mask: bool) -> bytes:
+    # Clients must mask their frames, servers must not
+    header = bytearray([0x80 | opcode])
+    mask_bit = 0x80 if mask else 0
+    length = len(payload)
+    if length < 126:
+        header.append(mask_bit | length)
+    elif length < 1 << 16:
+        header.append(mask_bit | 126)
+        header += length.to_bytes(2, "big")
+    else:
+        header.append(mask_bit | 127)
+        header += length.to_bytes(8, "big")
+    if mask:
+        key = os.urandom(4)
+        header += key
+        payload = _mask(payload, key)
+    return bytes(header) + payload
+
+
+def parse_frame(buffer: bytes | bytearray) -> tuple[bool, int, bytes, int] | None:
+    # Returns fin, opcode, payload and the bytes used, or None if incomplete
+    if len(buffer) < 2:
+        return None
+    length = buffer[1] & 0x7F
+    pos = 2
+    if length == 126:
+        if len(buffer) < 4:
+            return None
+        length = int.from_bytes(buffer[2:4], "big")
+        pos = 4
+    elif length == 127:
+        if len(buffer) < 10:
+            return None
+        length = int.from_bytes(buffer[2:10], "big")
+        pos = 10
+    key = None
+    if buffer[1] & 0x80:
+        if len(buffer) < pos + 4:
+            return None
+        key = bytes(buffer[pos : pos + 4])
+        pos += 4
+    if len(buffer) < pos + length:
+        return None
+    payload = bytes(buffer[pos : pos + length])
+    if key is not None:
+        payload = _mask(payload, key)
+    return bool(buffer[0] & 0x80), buffer[0] & 0x0F, payload, pos + length
+
+
+class WebSocket:
+    def __init__(self, sock: socket.socket, mask: bool = True):
+        self.sock: socket.socket = sock
+        self.mask: bool = mask
+        self._buffer = bytearray()
+        self._send_lock = threading.Lock()
+
+    @classmethod
+    def connect(cls, url: str, timeout: float = 10.0):
+        parts = urlsplit(url)
+        secure = parts.scheme == "wss"
+        sock = socket.create_connection(
+            (parts.hostname, parts.port or (443 if secure else 80)), timeout
+        )
+        if secure:
+            sock = ssl.create_default_context().wrap_socket(
+                sock, server_hostname=parts.hostname
+            )
+        ws = cls(sock)
+        try:
+            ws._handshake(parts)
+        except BaseException:
+            sock.close()
+            raise
+        return ws
+
+    def _handshake(self, parts) -> None:
+        key = base64.b64encode(os.urandom(16)).decode()
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        self.sock.sendall(
+            (
+                f"GET {path} HTTP/1.1\r\n"
+                f"Host: {parts.netloc}\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Key: {key}\r\n"
+                "Sec-WebSocket-Version: 13\r\n\r\n"
+            ).encode()
+        )
+        while b"\r\n\r\n" not in self._buffer:
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                raise ConnectionError("Connection closed during the handshake")
+            self._buffer += chunk
+        head, _, rest = bytes(self._buffer).partition(b"\r\n\r\n")
+        # Frames sent right after the handshake may already be here
+        self._buffer = bytearray(rest)
+        status, *lines = head.decode("latin-1").split("\r\n")
+        headers = {}
+        for line in lines:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if status.split()[1:2] != ["101"]:
+            raise ConnectionError(f"Websocket upgrade failed: {status}")
+        if headers.get("sec-websocket-accept") != accept_key(key):
+            raise ConnectionError("Websocket upgrade failed: bad accept key")
+
+    def send(self, data: bytes, opcode: int = OP_TEXT) -> None:
+        with self._send_lock:
+            self.sock.sendall(encode_frame(opcode, data, self.mask))
+
+    def recv(self, timeout: float | None = None) -> bytes:
+        # Raises TimeoutError without losing partially received frames
+        self.sock.settimeout(timeout)
+        message = b""
+        while True:
+            fin, opcode, payload = self._frame()
+            if opcode == OP_PING:
+                self.send(payload, OP_PONG)
+            elif opcode == OP_CLOSE:
+                code = int.from_bytes(payload[:2], "big") if payload else None
+                try:
+                    self.send(payload[:2], OP_CLOSE)
+                except OSError:
+                    pass
+                raise GatewayClosed(code, payload[2:].decode(errors="replace"))
+            elif opcode != OP_PONG:
+                message += payload
+                if fin:
+                    return message
+
+    def _frame(self) -> tuple[bool, int, bytes]:
+        while True:
+            frame = parse_frame(self._buffer)
+            if frame is not None:
+                fin, opcode, payload, used = frame
+                del self._buffer[:used]
+                return fin, opcode, payload
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise GatewayClosed(None, "connection lost")
+            self._buffer += chunk
+
+    def close(self, code: int = 1000) -> None:
+        try:
+            self.send(code.to_bytes(2, "big"), OP_CLOSE)
+            # Wakes up a thread blocked in recv
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class GatewayListener:
+    def __init__(
+        self,
+        user,
+        url: str | None = None,
+        trackers: Iterable = (),
+        backoff: RetryPolicy | None = None,
+        connect_timeout: float = 10.0,
+    ):
+        self.user = user
+        self.url: str | None = url
+        self.backoff: RetryPolicy = (
+            backoff if backoff is not None else RetryPolicy(base=1.0, cap=60.0)
+        )
+        self.connect_timeout: float = connect_timeout
+        # DMTrackers fed from the snapshots and events
+        self.trackers: list = list(trackers)
+        self.snapshots: int = 0
+        self.events: int = 0
+        self.reconnects: int = 0
+        # Set once a fatal error (like a revoked token) stopped the listener
+        self.error: BaseException | None = None
+        # Why the last connection ended, for a listener that keeps reconnecting
+        self.last_error: BaseException | None = None
+        self.ready = threading.Event()
+        self._stop = threading.Event()
+        self._ws: WebSocket | None = None
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="discord-sender-gateway", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        ws = self._ws
+        if ws is not None:
+            ws.close()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        return self.ready.wait(timeout)
+
+    def _run(self) -> None:
+        failures = 0
+        while not self._stop.is_set():
+            try:
+                self._connect()
+            except Exception as error:
+                self.last_error = error
+                if isinstance(error, InvalidCredentialsException) or (
+                    isinstance(error, GatewayClosed) and error.code in FATAL_CLOSE_CODES
+                ):
+                    self.error = error
+                    return
+            finally:
+                # A connection that got ready resets the backoff
+                failures = 0 if self.ready.is_set() else failures + 1
+                self._disconnected()
+            if self._stop.is_set():
+                return
+            self.reconnects += 1
+            self._stop.wait(self.backoff.delay(failures))
+
+    def _disconnected(self) -> None:
+        self._ws = None
+        self.ready.clear()
+        # Without events the cache ages out again like a polled one
+        self.user.channel_cache.live = False
+
+    def _gateway_url(self) -> str:
+        if self.url is None:
+            response = self.user.transport.request(
+                "GET",
+                "/gateway",
+                retry=self.user.retry_policy,
+                headers={"Authorization": self.user.user_info.get_token()},
+            )
+            if not response.ok:
+                self.user._handle_error(response)
+            self.url = self.user.transport.decode(response)["url"]
+        return self.url if "?" in self.url else self.url + GATEWAY_QUERY
+
+    def _connect(self) -> None:
+        codec = self.user.transport.codec
+        ws = self._ws = WebSocket.connect(self._gateway_url(), self.connect_timeout)
+        if self._stop.is_set():
+            return ws.close()
+        hello = codec.loads(ws.recv(self.connect_timeout))
+        if hello["op"] != HELLO:
+            raise ValueError(f"Expected HELLO from the gateway, got op {hello['op']}")
+        interval = hello["d"]["heartbeat_interval"] / 1000
+        ws.send(
+            codec.dumps(
+                {
+                    "op": IDENTIFY,
+                    "d": {
+                        "token": self.user.user_info.get_token(),
+                        "capabilities": 0,
+                        "properties": {"os": "Linux", "browser": "discord-sender"},
+                        "compress": False,
+                    },
+                }
+            )
+        )
+        sequence = None
+        acked = True
+        # The first heartbeat is jittered so reconnecting clients spread out
+        next_beat = time.monotonic() + interval * random.random()
+        while not self._stop.is_set():
+            wait = next_beat - time.monotonic()
+            if wait <= 0:
+                if not acked:
+                    raise GatewayClosed(None, "no heartbeat ack")
+                ws.send(codec.dumps({"op": HEARTBEAT, "d": sequence}))
+                acked = False
+                next_beat = time.monotonic() + interval
+                continue
+            try:
+                payload = codec.loads(ws.recv(wait))
+            except TimeoutError:
+                continue
+            op = payload["op"]
+            if op == HEARTBEAT_ACK:
+                acked = True
+            elif op == HEARTBEAT:
+                ws.send(codec.dumps({"op": HEARTBEAT, "d": sequence}))
+            elif op in (RECONNECT, INVALID_SESSION):
+                raise GatewayClosed(None, f"op {op}")
+            elif op == DISPATCH:
+                sequence = payload.get("s", sequence)
+                self._dispatch(payload["t"], payload["d"])
+
+    def _dispatch(self, event: str, data: dict) -> None:
+        if event == "READY":
+            self._snapshot()
+            return
+        if event not in (CHANNEL_CREATE, CHANNEL_UPDATE, CHANNEL_DELETE):
+            return
+        if data.get("guild_id") is not None or data.get("type") not in (1, 3):
+            return
+        self.events += 1
+        channel = Channel.lazy(
+            data["id"], data.get("recipients", []), data["type"], data.get("name")
+        )
+        if event == CHANNEL_DELETE:
+            channel = self.user.channel_cache.remove(channel.channel_id) or channel
+            for user_id in channel.recipient_ids():
+                if self.user.channel_ids.get(user_id) == channel.channel_id:
+                    self.user.channel_ids.discard(user_id)
+        else:
+            self.user.channel_cache.add(channel)
+        for tracker in self.trackers:
+            tracker.apply(event, channel)
+
+    def _snapshot(self) -> None:
+        # Events are only sent from now on, so everything before comes from REST
+        dms = self.user.get_dms(True)
+        self.user.channel_cache.live = True
+        self.snapshots += 1
+        for tracker in self.trackers:
+            tracker.refresh(dms)
+        self.ready.set()
@@ -0,0 +1,207 @@
+import bisect
+import threading
+
+
+class RequestInfo:
+    __slots__ = (
+        "method",
+        "endpoint",
+        "url",
+        "attempt",
+        "request_bytes",
+        "status",
+        "response_bytes",
+        "started",
+        "duration",
+        "error",
+    )
+
+    def __init__(
+        self, method: str, endpoint: str, url: str, attempt: int, request_bytes: int
+    ):
+        self.method: str = method
+        # The route template, so /channels/1/messages and /channels/2/messages group
+        self.endpoint: str = endpoint
+        self.url: str = url
+        self.attempt: int = attempt
+        self.request_bytes: int = request_bytes
+        self.status: int | None = None
+        self.response_bytes: int | None = None
+        # perf_counter() when the request was sent
+        self.started: float | None = None
+        self.duration: float | None = None
+        self.error: BaseException | None = None
+
+    @property
+    def outcome(self) -> str:
+        if self.error is not None:
+            return type(self.error).__name__
+        return str(self.status)
+
+
+class RequestObserver:
+    def on_request_start(self, info: RequestInfo) -> None:
+        pass
+
+    def on_request_end(self, info: RequestInfo) -> None:
+        pass
+
+    def on_error_handled(self, status: int, error: BaseException, duration: float):
+        pass
+
+    def on_channel_resolved(self, resolution) -> None:
+        pass
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets: tuple[float, ...] = buckets
+        self.counts: list[int] = [0] * (len(buckets) + 1)
+        self.sum: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        total = 0
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        result = []
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class MetricsCollector(RequestObserver):
+    PREFIX = "discord_sender"
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets: tuple[float, ...] = buckets
+        self._lock = threading.Lock()
+        self.durations: dict[tuple[str, str, str], Histogram] = {}
+        self.retries: dict[tuple[str, str], int] = {}
+        self.request_bytes: dict[tuple[str, str], int] = {}
+        self.response_bytes: dict[tuple[str, str], int] = {}
+        self.error_handling: dict[str, Histogram] = {}
+        self.resolutions: dict[str, int] = {}
+
+    def on_request_end(self, info: RequestInfo) -> None:
+        key = (info.method, info.endpoint)
+        with self._lock:
+            histogram = self.durations.get((*key, info.outcome))
+            if histogram is None:
+                histogram = self.durations[(*key, info.outcome)] = Histogram(
+                    self.buckets
+                )
+            histogram.observe(info.duration)
+            if info.attempt:
+                self.retries[key] = self.retries.get(key, 0) + 1
+            self.request_bytes[key] = self.request_bytes.get(key, 0) + (
+                info.request_bytes or 0
+            )
+            self.response_bytes[key] = self.response_bytes.get(key, 0) + (
+                info.response_bytes or 0
+            )
+
+    def on_error_handled(self, status: int, error: BaseException, duration: float):
+        name = type(error).__name__
+        with self._lock:
+            histogram = self.error_handling.get(name)
+            if histogram is None:
+                histogram = self.error_handling[name] = Histogram(self.buckets)
+            histogram.observe(duration)
+
+    def on_channel_resolved(self, resolution) -> None:
+        with self._lock:
+            self.resolutions[resolution.source] = (
+                self.resolutions.get(resolution.source, 0) + 1
+            )
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            endpoints = {}
+            for (method, endpoint, outcome), histogram in self.durations.items():
+                entry = endpoints.setdefault(
+                    f"{method} {endpoint}",
+                    {
+                        "requests": 0,
+                        "statuses": {},
+                        "duration_sum": 0.0,
+                        "retries": self.retries.get((method, endpoint), 0),
+                        "request_bytes": self.request_bytes.get((method, endpoint), 0),
+                        "response_bytes": self.response_bytes.get(
+                            (method, endpoint), 0
+                        ),
+                    },
+                )
+                entry["requests"] += histogram.count
+                entry["statuses"][outcome] = histogram.count
+                entry["duration_sum"] += histogram.sum
+            return {
+                "endpoints": endpoints,
+                "error_handling": {
+                    name: {"count": histogram.count, "duration_sum": histogram.sum}
+                    for name, histogram in self.error_handling.items()
+                },
+                "channel_resolutions": dict(self.resolutions),
+            }
+
+    def prometheus(self) -> str:
+        name = f"{self.PREFIX}_request_duration_seconds"
+        lines = [
+            f"# HELP {name} Time spent in discord api requests.",
+            f"# TYPE {name} histogram",
+        ]
+        with self._lock:
+            for (method, endpoint, outcome), histogram in self.durations.items():
+                labels = _labels(method=method, endpoint=endpoint, status=outcome)
+                lines.extend(_histogram_lines(name, labels, histogram))
+            for metric, values, help_text in (
+                ("request_retries_total", self.retries, "Retried requests."),
+                ("request_bytes_total", self.request_bytes, "Bytes sent."),
+                ("response_bytes_total", self.response_bytes, "Bytes received."),
+            ):
+                lines.append(f"# HELP {self.PREFIX}_{metric} {help_text}")
+                lines.append(f"# TYPE {self.PREFIX}_{metric} counter")
+                for (method, endpoint), value in values.items():
+                    labels = _labels(method=method, endpoint=endpoint)
+                    lines.append(f"{self.PREFIX}_{metric}{{{labels}}} {value}")
+            name = f"{self.PREFIX}_error_handling_seconds"
+            lines.append(
+                f"# HELP {name} Time spent turning error responses into exceptions."
+            )
+            lines.append(f"# TYPE {name} histogram")
+            for error, histogram in self.error_handling.items():
+                lines.extend(_histogram_lines(name, _labels(error=error), histogram))
+            name = f"{self.PREFIX}_channel_resolutions_total"
+            lines.append(
+                f"# HELP {name} Channel lookups by where the channel was found."
+            )
+            lines.append(f"# TYPE {name} counter")
+            for source, count in self.resolutions.items():
+                lines.append(f"{name}{{{_labels(source=source)}}} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(**labels: str) -> str:
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _histogram_lines(name: str, labels: str, histogram: Histogram) -> list[str]:
+    lines = [
+        f'{name}_bucket{{{labels},le="{bound}"}} {count}'
+        for bound, count in histogram.cumulative()
+    ]
+    lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return lines
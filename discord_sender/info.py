@@ -2,6 +2,8 @@ from .discord_exceptions import ArgumentError
 
 
 class DiscordLoginInfo:
+    __slots__ = ("__token", "__cookie", "uid", "preferred_method")
+
     def __init__(
         self, *, token: str | None = None, cookie: None = None, uid: str | None = None
     ):
@@ -0,0 +1,64 @@
+from .other import OtherUser
+
+
+class Message:
+    __slots__ = (
+        "message_id",
+        "channel_id",
+        "author",
+        "content",
+        "timestamp",
+        "edited_timestamp",
+        "type",
+        "attachments",
+    )
+
+    def __init__(
+        self,
+        message_id: str,
+        channel_id: str,
+        author: OtherUser | None,
+        content: str = "",
+        timestamp: str | None = None,
+        edited_timestamp: str | None = None,
+        msg_type: int = 0,
+        attachments: list[dict] | None = None,
+    ):
+        self.message_id: str = message_id
+        self.channel_id: str = channel_id
+        self.author: OtherUser | None = author
+        self.content: str = content
+        self.timestamp: str | None = timestamp
+        self.edited_timestamp: str | None = edited_timestamp
+        self.type: int = msg_type
+        self.attachments: list[dict] = attachments or []
+
+    @classmethod
+    def from_json(cls, data: dict):
+        author = data.get("author")
+        return cls(
+            data["id"],
+            data.get("channel_id"),
+            # Interned, so a long history holds one object per author
+            OtherUser.from_json(author) if author else None,
+            data.get("content", ""),
+            data.get("timestamp"),
+            data.get("edited_timestamp"),
+            data.get("type", 0),
+            data.get("attachments"),
+        )
+
+    def __repr__(self):
+        return f"{self.message_id}: {self.author!r}: {self.content!r}"
+
+    def __hash__(self) -> int:
+        return hash(self.message_id)
+
+    def __eq__(self, other):
+        if not isinstance(other, Message):
+            return False
+        return (
+            self.message_id == other.message_id
+            and self.content == other.content
+            and self.edited_timestamp == other.edited_timestamp
+        )
@@ -0,0 +1,152 @@
+import io
+import mimetypes
+import os
+import uuid
+from collections.abc import Callable
+
+from .discord_exceptions import ArgumentError
+
+
+class _FilePart:
+    __slots__ = ("file", "start", "length", "owned")
+
+    def __init__(self, file, start: int, length: int, owned: bool):
+        self.file = file
+        self.start: int = start
+        self.length: int = length
+        self.owned: bool = owned
+
+    def __len__(self) -> int:
+        return self.length
+
+
+def attachment_name(source, index: int) -> str:
+    name = source if isinstance(source, (str, os.PathLike)) else None
+    name = getattr(source, "name", name)
+    if isinstance(name, (str, os.PathLike)):
+        return os.path.basename(name)
+    return f"file{index}"
+
+
+def _open_file(source) -> _FilePart:
+    if isinstance(source, (str, os.PathLike)):
+        file = open(source, "rb")
+        return _FilePart(file, 0, os.fstat(file.fileno()).st_size, True)
+    if not (hasattr(source, "read") and hasattr(source, "seek")):
+        raise ArgumentError("Attachments must be paths or seekable binary files")
+    start = source.tell()
+    length = source.seek(0, io.SEEK_END) - start
+    source.seek(start)
+    return _FilePart(source, start, length, False)
+
+
+class MultipartBody:
+    def __init__(
+        self,
+        fields: list[tuple[str, bytes, str]],
+        files: list,
+        progress: Callable[[int, int], None] | None = None,
+        boundary: str | None = None,
+    ):
+        self.boundary: str = boundary or uuid.uuid4().hex
+        self.progress: Callable[[int, int], None] | None = progress
+        self.filenames: list[str] = []
+        self._parts: list[bytes | _FilePart] = []
+        for name, value, content_type in fields:
+            self._parts.append(self._header(name, content_type))
+            self._parts.append(value + b"\r\n")
+        try:
+            for index, source in enumerate(files):
+                part = _open_file(source)
+                filename = attachment_name(source, index)
+                self.filenames.append(filename)
+                content_type = (
+                    mimetypes.guess_type(filename)[0] or "application/octet-stream"
+                )
+                self._parts.append(
+                    self._header(f"files[{index}]", content_type, filename)
+                )
+                self._parts.append(part)
+                self._parts.append(b"\r\n")
+        except BaseException:
+            self.close()
+            raise
+        self._parts.append(f"--{self.boundary}--\r\n".encode())
+        self._length: int = sum(len(part) for part in self._parts)
+        self._index: int = 0
+        self._offset: int = 0
+        self._position: int = 0
+
+    def _header(self, name: str, content_type: str, filename: str | None = None):
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            quoted = filename.replace("\\", "\\\\").replace('"', '\\"')
+            disposition += f'; filename="{quoted}"'
+        return (
+            f"--{self.boundary}\r\n"
+            f"Content-Disposition: {disposition}\r\n"
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode()
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return self._length
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        # Only rewinding is needed, for retries
+        if (offset, whence) != (0, io.SEEK_SET):
+            raise io.UnsupportedOperation("MultipartBody can only be rewound")
+        self._index = self._offset = self._position = 0
+        return 0
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self._length - self._position
+        chunks = []
+        while size > 0 and self._index < len(self._parts):
+            part = self._parts[self._index]
+            if isinstance(part, _FilePart):
+                if self._offset == 0:
+                    part.file.seek(part.start)
+                chunk = part.file.read(min(size, part.length - self._offset))
+                if not chunk:
+                    raise OSError("Attachment got shorter while uploading")
+            else:
+                chunk = part[self._offset : self._offset + size]
+            chunks.append(chunk)
+            size -= len(chunk)
+            self._offset += len(chunk)
+            self._position += len(chunk)
+            if self._offset == len(part):
+                self._index += 1
+                self._offset = 0
+        data = b"".join(chunks)
+        if data and self.progress is not None:
+            self.progress(self._position, self._length)
+        return data
+
+    def __iter__(self):
+        while chunk := self.read(65536):
+            yield chunk
+
+    def close(self) -> None:
+        for part in self._parts:
+            if not isinstance(part, _FilePart):
+                continue
+            if part.owned:
+                part.file.close()
+            else:
+                # Hand the caller's file back where it was
+                part.file.seek(part.start)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
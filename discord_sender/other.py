@@ -1,4 +1,16 @@
+import threading
+import weakref
+
+
 class OtherUser:
+    __slots__ = ("user_id", "username", "is_bot", "global_name", "__weakref__")
+
+    # One shared object per distinct user while anything still references it
+    _registry: "weakref.WeakValueDictionary[tuple, OtherUser]" = (
+        weakref.WeakValueDictionary()
+    )
+    _registry_lock = threading.Lock()
+
     def __init__(
         self,
         user_id: str,
@@ -11,6 +23,31 @@ class OtherUser:
         self.is_bot = is_bot
         self.global_name: str = global_name
 
+    @classmethod
+    def intern(
+        cls,
+        user_id: str,
+        username: str | None = None,
+        global_name: str | None = None,
+        is_bot: bool = False,
+    ):
+        key = (user_id, username, global_name, is_bot)
+        with cls._registry_lock:
+            user = cls._registry.get(key)
+            if user is None:
+                user = cls(user_id, username, global_name, is_bot)
+                cls._registry[key] = user
+            return user
+
+    @classmethod
+    def from_json(cls, data: dict):
+        return cls.intern(
+            user_id=data["id"],
+            global_name=data.get("global_name"),
+            username=data.get("username"),
+            is_bot=data.get("bot", False),
+        )
+
     def __repr__(self):
         return f"{self.user_id}: {self.username}{('/' + self.global_name) if self.global_name else ''}"
 
@@ -24,6 +61,10 @@ class OtherUser:
         except AttributeError:
             return False
 
+    def __hash__(self) -> int:
+        # Same fields as __eq__, username is only part of strict_equality_check
+        return hash((self.user_id, self.is_bot, self.global_name))
+
     def __eq__(self, other):  # TODO: Cover this
         try:
             if not isinstance(other, OtherUser):
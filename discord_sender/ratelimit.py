@@ -0,0 +1,163 @@
+import threading
+import time
+from collections.abc import Mapping
+
+
+class Route:
+    def __init__(self, method: str, path: str, **params):
+        self.method: str = method.upper()
+        self.template: str = path
+        self.path: str = path.format(**params) if params else path
+        # Discord keeps separate limits per channel for the same bucket
+        self.major: str | None = params.get("channel_id")
+
+    @property
+    def key(self) -> str:
+        return f"{self.method} {self.template}"
+
+    def __repr__(self):
+        return f"<Route {self.method} {self.path}>"
+
+
+class Bucket:
+    def __init__(self, name: str):
+        self.name: str = name
+        self.limit: int | None = None
+        self.remaining: int | None = None
+        self.reset_at: float = 0.0
+        # Longest Reset-After seen, the best guess for the length of a window
+        self.window: float = 0.0
+
+    def delay(self, now: float) -> float:
+        if self.remaining is None or self.remaining > 0:
+            return 0.0
+        return max(self.reset_at - now, 0.0)
+
+    def refill(self, now: float) -> None:
+        # A new window started without a response telling us about it
+        if self.limit is None or self.window <= 0 or now < self.reset_at:
+            return
+        self.remaining = self.limit
+        self.reset_at = now + self.window
+
+
+class RateLimiter:
+    def __init__(self, max_retries: int = 3, clock=time.monotonic, sleep=time.sleep):
+        self.max_retries: int = max_retries
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._routes: dict[str, str] = {}
+        self._buckets: dict[str, Bucket] = {}
+        self.global_reset_at: float = 0.0
+
+    def _bucket_key(self, route: Route) -> str:
+        name = self._routes.get(route.key, route.key)
+        return f"{name}:{route.major}" if route.major else name
+
+    def delay(self, route: Route) -> float:
+        with self._lock:
+            return self._delay(self._buckets.get(self._bucket_key(route)))
+
+    def _delay(self, bucket: Bucket | None) -> float:
+        now = self._clock()
+        delay = max(self.global_reset_at - now, 0.0)
+        if bucket is not None:
+            delay = max(delay, bucket.delay(now))
+        return delay
+
+    def acquire(self, route: Route) -> float:
+        waited = 0.0
+        while True:
+            with self._lock:
+                bucket = self._buckets.get(self._bucket_key(route))
+                if bucket is not None:
+                    bucket.refill(self._clock())
+                delay = self._delay(bucket)
+                if delay <= 0:
+                    if bucket is not None and bucket.remaining:
+                        # Checked and counted under one lock, so concurrent
+                        # callers can not both take the last request
+                        bucket.remaining -= 1
+                    return waited
+            # Others may have taken the new window, so check again after waking
+            self._sleep(delay)
+            waited += delay
+
+    def update(self, route: Route, response) -> float | None:
+        headers = getattr(response, "headers", None)
+        if not isinstance(headers, Mapping):
+            return None
+        with self._lock:
+            now = self._clock()
+            name = headers.get("X-RateLimit-Bucket")
+            if name:
+                self._routes[route.key] = name
+            key = self._bucket_key(route)
+            bucket = self._buckets.get(key)
+            if bucket is None and "X-RateLimit-Remaining" in headers:
+                bucket = self._buckets[key] = Bucket(name or route.key)
+            if bucket is not None:
+                if "X-RateLimit-Limit" in headers:
+                    bucket.limit = int(headers["X-RateLimit-Limit"])
+                if "X-RateLimit-Remaining" in headers:
+                    bucket.remaining = int(headers["X-RateLimit-Remaining"])
+                if "X-RateLimit-Reset-After" in headers:
+                    reset_after = float(headers["X-RateLimit-Reset-After"])
+                    bucket.reset_at = now + reset_after
+                    bucket.window = max(bucket.window, reset_after)
+            if response.status_code != 429:
+                return None
+            retry_after = _retry_after(response, headers)
+            if _is_global(response, headers):
+                self.global_reset_at = now + retry_after
+            else:
+                if bucket is None:
+                    bucket = self._buckets[key] = Bucket(name or route.key)
+                bucket.remaining = 0
+                bucket.reset_at = max(bucket.reset_at, now + retry_after)
+            return retry_after
+
+    def state(self) -> dict:
+        with self._lock:
+            now = self._clock()
+            return {
+                "global_reset_after": max(self.global_reset_at - now, 0.0),
+                "buckets": {
+                    key: {
+                        "bucket": bucket.name,
+                        "limit": bucket.limit,
+                        "remaining": bucket.remaining,
+                        "reset_after": max(bucket.reset_at - now, 0.0),
+                    }
+                    for key, bucket in self._buckets.items()
+                },
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._routes.clear()
+            self._buckets.clear()
+            self.global_reset_at = 0.0
+
+
+def _body(response) -> dict:
+    try:
+        body = response.json()
+    except ValueError:
+        return {}
+    return body if isinstance(body, dict) else {}
+
+
+def _retry_after(response, headers: Mapping) -> float:
+    if "Retry-After" in headers:
+        return float(headers["Retry-After"])
+    return float(_body(response).get("retry_after", 1.0))
+
+
+def _is_global(response, headers: Mapping) -> bool:
+    if "X-RateLimit-Global" in headers:
+        return headers["X-RateLimit-Global"].lower() == "true"
+    if headers.get("X-RateLimit-Scope") == "global":
+        return True
+    return bool(_body(response).get("global", False))
@@ -0,0 +1,48 @@
+import random
+import time
+
+from .deadline import Deadline
+
+RETRY_STATUSES = frozenset({500, 502, 503, 504})
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        attempts: int = 3,
+        base: float = 0.5,
+        cap: float = 8.0,
+        jitter: bool = True,
+        statuses: frozenset[int] = RETRY_STATUSES,
+        rng=random.random,
+        sleep=time.sleep,
+    ):
+        self.attempts: int = attempts
+        self.base: float = base
+        self.cap: float = cap
+        self.jitter: bool = jitter
+        self.statuses: frozenset[int] = statuses
+        self._rng = rng
+        self._sleep = sleep
+
+    def can_retry(self, attempt: int) -> bool:
+        return attempt < self.attempts
+
+    def retry_status(self, status_code: int) -> bool:
+        return status_code in self.statuses
+
+    def delay(self, attempt: int) -> float:
+        delay = min(self.cap, self.base * 2**attempt)
+        # Full jitter keeps clients that failed together from retrying together
+        return self._rng() * delay if self.jitter else delay
+
+    def wait(self, attempt: int, deadline: Deadline | None = None) -> float:
+        delay = self.delay(attempt)
+        if deadline is not None:
+            deadline.ensure(delay)
+        if delay > 0:
+            self._sleep(delay)
+        return delay
+
+
+NO_RETRY = RetryPolicy(attempts=0)
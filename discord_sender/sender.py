@@ -0,0 +1,76 @@
+import atexit
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class SendQueue:
+    def __init__(self, maxsize: int = 1000):
+        self.maxsize: int = maxsize
+        self._queue: queue.Queue = queue.Queue(maxsize)
+        self._lock = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self._closed: bool = False
+        # Submits that passed the closed check but are not queued yet
+        self._submitting: int = 0
+
+    def __len__(self) -> int:
+        return self._queue.qsize()
+
+    def closed(self) -> bool:
+        return self._closed
+
+    def submit(
+        self, func, *args, block: bool = True, timeout: float | None = None, **kwargs
+    ) -> Future:
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The send queue is closed")
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="discord-sender-queue", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.close)
+            self._submitting += 1
+        future = Future()
+        try:
+            # A full queue blocks the caller (or raises queue.Full) as backpressure
+            self._queue.put((future, func, args, kwargs), block, timeout)
+        finally:
+            with self._lock:
+                self._submitting -= 1
+                self._lock.notify_all()
+        return future
+
+    def _run(self) -> None:
+        # One worker keeps messages in submission order for every channel
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, func, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def close(self, wait: bool = True) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+            # Accepted sends must be queued ahead of the sentinel
+            self._lock.wait_for(lambda: not self._submitting)
+        atexit.unregister(self.close)
+        if thread is None:
+            return
+        # Queued sends are flushed before the worker sees the sentinel
+        self._queue.put(None)
+        if wait:
+            thread.join()
@@ -0,0 +1,83 @@
+import asyncio
+import concurrent.futures
+import threading
+from collections.abc import Awaitable, Callable, Hashable
+
+from .deadline import Deadline
+from .discord_exceptions import DeadlineExceeded
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, concurrent.futures.Future] = {}
+        # Callers that were answered by someone else's request
+        self.shared: int = 0
+
+    def do(self, key: Hashable, func: Callable, deadline: Deadline | None = None):
+        while True:
+            with self._lock:
+                future = self._calls.get(key)
+                leader = future is None
+                if leader:
+                    future = self._calls[key] = concurrent.futures.Future()
+                else:
+                    self.shared += 1
+            if leader:
+                break
+            done, _ = concurrent.futures.wait(
+                [future], None if deadline is None else deadline.remaining()
+            )
+            if not done:
+                raise DeadlineExceeded(f"Deadline of {deadline.timeout}s exceeded")
+            error = future.exception()
+            # The leader ran out of its own time, ours may not be up yet
+            if not isinstance(error, DeadlineExceeded) or (
+                deadline is not None and deadline.expired()
+            ):
+                return future.result()
+            with self._lock:
+                self.shared -= 1
+        try:
+            result = func()
+        except BaseException as error:
+            self._finish(key)
+            future.set_exception(error)
+            raise
+        self._finish(key)
+        future.set_result(result)
+        return result
+
+    def _finish(self, key: Hashable) -> None:
+        # Later callers start a new request instead of getting this result
+        with self._lock:
+            del self._calls[key]
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+
+class AsyncSingleFlight:
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Future] = {}
+        self.shared: int = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable]):
+        task = self._calls.get(key)
+        if task is not None and not task.done():
+            self.shared += 1
+        else:
+            # Its own task, so a cancelled caller (even the first) cancels nobody else
+            task = self._calls[key] = asyncio.ensure_future(func())
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Every caller may be gone, keep asyncio from reporting the exception
+        if not task.cancelled():
+            task.exception()
+
+    def __len__(self) -> int:
+        return len(self._calls)
@@ -0,0 +1,435 @@
+import email.parser
+import email.policy
+import itertools
+import json
+import re
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from .gateway import (CHANNEL_CREATE, CHANNEL_DELETE, CHANNEL_UPDATE, DISPATCH,
+                      HEARTBEAT, HEARTBEAT_ACK, HELLO, IDENTIFY, WebSocket,
+                      accept_key)
+from .transport import API_PATH
+
+STUB_TOKEN = "stub-token"
+STUB_USER_ID = "100000000000000000"
+
+
+def synthetic_channels(count: int, users: int = 500) -> list[dict]:
+    # Every tenth channel is a group dm, recipients are drawn from a fixed set of users
+    channels = []
+    for n in range(count):
+        members = range(n % users, n % users + (5 if n % 10 == 0 else 1))
+        channels.append(
+            {
+                "id": str(900000000000000000 + n),
+                "type": 3 if n % 10 == 0 else 1,
+                "name": f"group {n}" if n % 10 == 0 else None,
+                "recipients": [
+                    {
+                        "id": str(800000000000000000 + m % users),
+                        "username": f"user{m % users}",
+                        "global_name": f"User {m % users}",
+                    }
+                    for m in members
+                ],
+            }
+        )
+    return channels
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients that gave up on a slow response (timeouts, deadlines) are expected
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class StubDiscordServer:
+    def __init__(
+        self,
+        token: str = STUB_TOKEN,
+        email: str = "stub@example.com",
+        password: str = "stub-password",
+        channels: list[dict] | None = None,
+        users: dict[str, dict] | None = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        rate_limit_every: int = 0,
+        retry_after: float = 0.05,
+    ):
+        self.token: str = token
+        self.email: str = email
+        self.password: str = password
+        self.channels: list[dict] = channels if channels is not None else []
+        self.users: dict[str, dict] = users if users is not None else {}
+        for channel in self.channels:
+            for user in channel["recipients"]:
+                self.users.setdefault(user["id"], user)
+        self.messages: dict[str, list[dict]] = {}
+        # Uploaded file contents by message id
+        self.attachments: dict[str, list[bytes]] = {}
+        self.requests: list[tuple[str, str]] = []
+        # Seconds added to every response and every n-th api request answered with 429
+        self.latency: float = latency
+        self.rate_limit_every: int = rate_limit_every
+        self.retry_after: float = retry_after
+        self.rate_limited: int = 0
+        # Connected gateway clients, they get channel events as the stub changes
+        self.gateways: list[WebSocket] = []
+        self.identified: int = 0
+        self.heartbeat_interval: float = 41.25
+        self.ack_heartbeats: bool = True
+        self._sequence = itertools.count(1)
+        self._api_requests: int = 0
+        self._ids = itertools.count(200000000000000000)
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _handler(self))
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, args=(0.05,), daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.disconnect_gateways()
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def should_rate_limit(self) -> bool:
+        with self._lock:
+            self._api_requests += 1
+            if (
+                self.rate_limit_every
+                and self._api_requests % self.rate_limit_every == 0
+            ):
+                self.rate_limited += 1
+                return True
+            return False
+
+    def next_id(self) -> str:
+        with self._lock:
+            return str(next(self._ids))
+
+    def dm_channel(self, user_id: str) -> dict:
+        with self._lock:
+            for channel in self.channels:
+                if channel["type"] == 1 and [
+                    user["id"] for user in channel["recipients"]
+                ] == [user_id]:
+                    return channel
+            channel = {
+                "id": str(next(self._ids)),
+                "type": 1,
+                "recipients": [self.users[user_id]],
+            }
+        self.add_channel(channel)
+        return channel
+
+    @property
+    def gateway_url(self) -> str:
+        return "ws" + self.url[len("http") :] + "/gateway"
+
+    def dispatch(self, event: str, data: dict) -> None:
+        with self._lock:
+            gateways = list(self.gateways)
+        for ws in gateways:
+            self.send_event(ws, event, data)
+
+    def send_event(self, ws: WebSocket, event: str, data: dict) -> None:
+        payload = {"op": DISPATCH, "t": event, "s": next(self._sequence), "d": data}
+        try:
+            ws.send(json.dumps(payload).encode())
+        except OSError:
+            pass
+
+    def add_channel(self, channel: dict) -> None:
+        with self._lock:
+            self.channels.append(channel)
+            for user in channel["recipients"]:
+                self.users.setdefault(user["id"], user)
+        self.dispatch(CHANNEL_CREATE, channel)
+
+    def update_channel(self, channel: dict) -> None:
+        with self._lock:
+            self.channels = [
+                channel if old["id"] == channel["id"] else old for old in self.channels
+            ]
+        self.dispatch(CHANNEL_UPDATE, channel)
+
+    def remove_channel(self, channel_id: str) -> None:
+        with self._lock:
+            channel = self.find_channel(channel_id)
+            self.channels.remove(channel)
+        self.dispatch(CHANNEL_DELETE, channel)
+
+    def disconnect_gateways(self, code: int | None = None) -> None:
+        # Without a code the connections just drop, like a network failure
+        with self._lock:
+            gateways, self.gateways = self.gateways, []
+        for ws in gateways:
+            if code is not None:
+                ws.close(code)
+            else:
+                ws.sock.shutdown(socket.SHUT_RDWR)
+
+    def find_channel(self, channel_id: str) -> dict | None:
+        return next(
+            (channel for channel in self.channels if channel["id"] == channel_id), None
+        )
+
+
+def _handler(stub: StubDiscordServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body go out in separate writes, Nagle would delay the body
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            self._dispatch("GET")
+
+        def do_POST(self):
+            self._dispatch("POST")
+
+        def _dispatch(self, method: str):
+            parts = urlsplit(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            self.body = self.rfile.read(length) if length else b""
+            self.query = dict(parse_qsl(parts.query))
+            with stub._lock:
+                stub.requests.append((method, parts.path))
+            if stub.latency:
+                time.sleep(stub.latency)
+            path = parts.path
+            if path == "/gateway" and self.headers.get("Upgrade") == "websocket":
+                return self._gateway()
+            if path == "/login":
+                return self._send(
+                    200, b"<html></html>", "text/html", {"Set-Cookie": "__dcfduid=stub"}
+                )
+            if not path.startswith(API_PATH):
+                return self._json(404, {"message": "404: Not Found", "code": 0})
+            path = path[len(API_PATH) :]
+            if stub.should_rate_limit():
+                return self._json(
+                    429,
+                    {
+                        "message": "You are being rate limited.",
+                        "retry_after": stub.retry_after,
+                        "global": False,
+                    },
+                    {
+                        "Retry-After": str(stub.retry_after),
+                        "X-RateLimit-Remaining": "0",
+                        "X-RateLimit-Reset-After": str(stub.retry_after),
+                        "X-RateLimit-Scope": "user",
+                    },
+                )
+            for route_method, pattern, name in ROUTES:
+                match = re.fullmatch(pattern, path)
+                if route_method == method and match:
+                    if name != "login" and not self._authorized():
+                        return self._json(
+                            401, {"message": "401: Unauthorized", "code": 0}
+                        )
+                    return getattr(self, name)(*match.groups())
+            self._json(404, {"message": "404: Not Found", "code": 0})
+
+        def _gateway(self):
+            self.close_connection = True
+            self.send_response(101)
+            self.send_header("Upgrade", "websocket")
+            self.send_header("Connection", "Upgrade")
+            self.send_header(
+                "Sec-WebSocket-Accept", accept_key(self.headers["Sec-WebSocket-Key"])
+            )
+            self.end_headers()
+            ws = WebSocket(self.connection, mask=False)
+            interval = int(stub.heartbeat_interval * 1000)
+            ws.send(
+                json.dumps(
+                    {"op": HELLO, "d": {"heartbeat_interval": interval}}
+                ).encode()
+            )
+            try:
+                while True:
+                    payload = json.loads(ws.recv())
+                    if payload["op"] == IDENTIFY:
+                        if payload["d"].get("token") != stub.token:
+                            return ws.close(4004)
+                        with stub._lock:
+                            stub.gateways.append(ws)
+                            stub.identified += 1
+                        user = {"id": STUB_USER_ID, "username": "stub"}
+                        stub.send_event(ws, "READY", {"user": user})
+                    elif payload["op"] == HEARTBEAT and stub.ack_heartbeats:
+                        ws.send(json.dumps({"op": HEARTBEAT_ACK}).encode())
+            except OSError:
+                pass
+            finally:
+                with stub._lock:
+                    if ws in stub.gateways:
+                        stub.gateways.remove(ws)
+
+        def gateway(self):
+            self._json(200, {"url": stub.gateway_url})
+
+        def _authorized(self) -> bool:
+            return self.headers.get("Authorization") == stub.token
+
+        def _payload(self) -> dict:
+            self.files = []
+            if not self.body:
+                return {}
+            content_type = self.headers.get("Content-Type", "")
+            if content_type.startswith("application/json"):
+                return json.loads(self.body)
+            if content_type.startswith("multipart/form-data"):
+                return self._multipart(content_type)
+            return dict(parse_qsl(self.body.decode()))
+
+        def _multipart(self, content_type: str) -> dict:
+            form = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + self.body
+            )
+            payload = {}
+            for part in form.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                if name == "payload_json":
+                    payload = json.loads(part.get_payload(decode=True))
+                else:
+                    self.files.append(
+                        (part.get_filename(), part.get_payload(decode=True))
+                    )
+            return payload
+
+        def _send(self, status: int, body: bytes, content_type: str, headers=None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _json(self, status: int, data, headers=None):
+            self._send(status, json.dumps(data).encode(), "application/json", headers)
+
+        def login(self):
+            creds = self._payload()
+            if (creds.get("login"), creds.get("password")) != (
+                stub.email,
+                stub.password,
+            ):
+                return self._json(
+                    400,
+                    {
+                        "message": "Invalid Form Body",
+                        "code": 50035,
+                        "errors": {
+                            "login": {
+                                "_errors": [
+                                    {
+                                        "code": "INVALID_LOGIN",
+                                        "message": "Login or password is invalid.",
+                                    }
+                                ]
+                            }
+                        },
+                    },
+                )
+            self._json(200, {"token": stub.token, "user_id": STUB_USER_ID})
+
+        def me(self):
+            self._json(200, {"id": STUB_USER_ID, "username": "stub"})
+
+        def list_channels(self):
+            self._json(200, stub.channels)
+
+        def open_channel(self):
+            user_id = self._payload().get("recipient_id")
+            if user_id not in stub.users:
+                return self._json(
+                    400, {"message": "Invalid Recipient(s)", "code": 50033}
+                )
+            self._json(200, stub.dm_channel(user_id))
+
+        def send_message(self, channel_id: str):
+            if stub.find_channel(channel_id) is None:
+                return self._json(404, {"message": "Unknown Channel", "code": 10003})
+            payload = self._payload()
+            nonce = payload.get("nonce")
+            if payload.get("enforce_nonce") and nonce is not None:
+                for sent in stub.messages.get(channel_id, []):
+                    if sent["nonce"] == nonce:
+                        return self._json(200, sent)
+            message = {
+                "id": stub.next_id(),
+                "channel_id": channel_id,
+                "content": payload.get("content", ""),
+                "nonce": payload.get("nonce"),
+                "author": {"id": STUB_USER_ID, "username": "stub"},
+                "attachments": [
+                    {"id": stub.next_id(), "filename": filename, "size": len(data)}
+                    for filename, data in self.files
+                ],
+            }
+            with stub._lock:
+                stub.messages.setdefault(channel_id, []).append(message)
+                if self.files:
+                    stub.attachments[message["id"]] = [data for _, data in self.files]
+            self._json(200, message)
+
+        def list_messages(self, channel_id: str):
+            if stub.find_channel(channel_id) is None:
+                return self._json(404, {"message": "Unknown Channel", "code": 10003})
+            limit = min(int(self.query.get("limit", 50)), 100)
+            messages = stub.messages.get(channel_id, [])
+            if "after" in self.query:
+                after = int(self.query["after"])
+                page = [m for m in messages if int(m["id"]) > after][:limit]
+            else:
+                before = int(self.query.get("before", 2**64))
+                page = [m for m in messages if int(m["id"]) < before][-limit:]
+            # Newest first, like discord
+            self._json(200, page[::-1])
+
+    return Handler
+
+
+ROUTES = [
+    ("GET", r"/gateway", "gateway"),
+    ("POST", r"/auth/login", "login"),
+    ("GET", r"/users/@me", "me"),
+    ("GET", r"/users/@me/channels", "list_channels"),
+    ("POST", r"/users/@me/channels", "open_channel"),
+    ("GET", r"/channels/(\d+)/messages", "list_messages"),
+    ("POST", r"/channels/(\d+)/messages", "send_message"),
+]
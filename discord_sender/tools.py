@@ -1,3 +1,13 @@
+import codecs
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+from collections.abc import Iterable, Iterator
+
+
 def ziplist(list1, list2, checkeq=lambda x, y: x == y):
     zipped = []
     for i in list1:
@@ -5,3 +15,91 @@ def ziplist(list1, list2, checkeq=lambda x, y: x == y):
             if checkeq(i, j):
                 zipped.append((i, j))
     return zipped
+
+
+DISCORD_EPOCH = 1420070400000
+_nonce_counter = itertools.count()
+
+
+def make_nonce() -> str:
+    # Snowflake layout: milliseconds, then process id bits, then a counter
+    timestamp = int(time.time() * 1000) - DISCORD_EPOCH
+    process = (os.getpid() & 0x3FF) << 12
+    return str((timestamp << 22) | process | (next(_nonce_counter) & 0xFFF))
+
+
+_WHITESPACE = " \t\n\r"
+
+
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator:
+    # Yields the items of a top level JSON array as soon as each one is complete
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    started = False
+    for chunk in chunks:
+        buffer += text.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE + ",":
+                if buffer[pos] == "," and not started:
+                    raise ValueError("Expected a JSON array")
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # Incomplete, wait for the next chunk
+            if end == len(buffer) and isinstance(item, (int, float)):
+                break  # A number may continue in the next chunk
+            pos = end
+            yield item
+        buffer = buffer[pos:]
+    raise ValueError("Truncated JSON array")
+
+
+def read_ahead(items: Iterator, depth: int = 2) -> Iterator:
+    # Pulls from items in a thread, at most depth results ahead of the consumer
+    buffer = queue.Queue(depth)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in items:
+                buffer.put((True, item))
+                if stop.is_set():
+                    return
+            buffer.put((False, None))
+        except BaseException as error:
+            buffer.put((False, error))
+        finally:
+            getattr(items, "close", lambda: None)()
+
+    threading.Thread(
+        target=produce, name="discord-sender-read-ahead", daemon=True
+    ).start()
+    try:
+        while True:
+            ok, item = buffer.get()
+            if not ok:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stop.set()
+        # Make room so a blocked producer sees stop and exits
+        while True:
+            try:
+                buffer.get_nowait()
+            except queue.Empty:
+                break
@@ -0,0 +1,103 @@
+import threading
+from collections.abc import Iterable
+
+from .channel import Channel, ChannelDiff
+from .discord import DiscordUser
+from .gateway import CHANNEL_DELETE
+
+
+def fingerprint(channel: Channel) -> tuple:
+    # Built from the raw ids so unchanged channels never materialize OtherUsers
+    return (channel.name, channel.type, tuple(sorted(channel.recipient_ids())))
+
+
+class DMTracker:
+    def __init__(self, user: DiscordUser, notify_initial: bool = False):
+        self.user: DiscordUser = user
+        self.notify_initial: bool = notify_initial
+        self.channels: dict[str, Channel] = {}
+        self._fingerprints: dict[str, tuple] = {}
+        self._on_new: list = []
+        self._on_closed: list = []
+        self._on_changed: list = []
+        self.primed: bool = False
+        # Refreshes and gateway events may come from different threads
+        self._lock = threading.RLock()
+
+    def on_new(self, callback):
+        self._on_new.append(callback)
+        return callback
+
+    def on_closed(self, callback):
+        self._on_closed.append(callback)
+        return callback
+
+    def on_changed(self, callback):
+        self._on_changed.append(callback)
+        return callback
+
+    def refresh(self, channels: Iterable[Channel] | None = None) -> ChannelDiff:
+        with self._lock:
+            return self._refresh(self.user.iter_dms() if channels is None else channels)
+
+    def _refresh(self, dms: Iterable[Channel]) -> ChannelDiff:
+        added = []
+        changed = []
+        previous = self._fingerprints
+        current: dict[str, tuple] = {}
+        channels: dict[str, Channel] = {}
+        for channel in dms:
+            new_print = fingerprint(channel)
+            current[channel.channel_id] = new_print
+            old_print = previous.get(channel.channel_id)
+            if old_print is None:
+                added.append(channel)
+            elif old_print != new_print:
+                changed.append((self.channels[channel.channel_id], channel))
+            else:
+                # Keep the old object so references held by callers stay valid
+                channel = self.channels[channel.channel_id]
+            channels[channel.channel_id] = channel
+        removed = [
+            self.channels[channel_id] for channel_id in previous.keys() - current.keys()
+        ]
+        self.channels = channels
+        self._fingerprints = current
+        diff = ChannelDiff(added, removed, changed)
+        if self.primed or self.notify_initial:
+            self._notify(diff)
+        self.primed = True
+        return diff
+
+    def apply(self, event: str, channel: Channel) -> ChannelDiff:
+        # One gateway event, without downloading the dms again
+        with self._lock:
+            old = self.channels.get(channel.channel_id)
+            if event == CHANNEL_DELETE:
+                diff = ChannelDiff([], [old] if old is not None else [], [])
+                self.channels.pop(channel.channel_id, None)
+                self._fingerprints.pop(channel.channel_id, None)
+            else:
+                new_print = fingerprint(channel)
+                if old is None:
+                    diff = ChannelDiff([channel], [], [])
+                elif self._fingerprints[channel.channel_id] != new_print:
+                    diff = ChannelDiff([], [], [(old, channel)])
+                else:
+                    return ChannelDiff([], [], [])
+                self.channels[channel.channel_id] = channel
+                self._fingerprints[channel.channel_id] = new_print
+            if self.primed:
+                self._notify(diff)
+            return diff
+
+    def _notify(self, diff: ChannelDiff) -> None:
+        for channel in diff.added:
+            for callback in self._on_new:
+                callback(channel)
+        for channel in diff.removed:
+            for callback in self._on_closed:
+                callback(channel)
+        for old, new in diff.changed:
+            for callback in self._on_changed:
+                callback(old, new)
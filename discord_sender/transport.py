@@ -0,0 +1,274 @@
+import threading
+import time
+from collections.abc import Mapping
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.utils import DEFAULT_ACCEPT_ENCODING
+
+from .channel import Channel
+from .codec import JSONCodec, get_codec
+from .config import check_eula
+from .connection import CircuitOpenError, ConnectivityTracker
+from .deadline import Deadline
+from .discord_exceptions import DeadlineExceeded
+from .hooks import RequestInfo, RequestObserver
+from .multipart import MultipartBody
+from .ratelimit import RateLimiter, Route
+from .retry import RetryPolicy
+
+DISCORD_URL = "https://discord.com"
+API_PATH = "/api/v9"
+
+
+class Transport:
+    def __init__(
+        self,
+        base_url: str = DISCORD_URL,
+        pool_connections: int = 4,
+        pool_maxsize: int = 10,
+        timeout: float | tuple[float, float] = (5.0, 30.0),
+        keep_alive: bool = True,
+        compress: bool = True,
+        connectivity: ConnectivityTracker | None = None,
+        rate_limiter: RateLimiter | None = None,
+        codec: JSONCodec | str | None = None,
+    ):
+        self.base_url: str = base_url.rstrip("/")
+        self.api_url: str = self.base_url + API_PATH
+        self.pool_connections: int = pool_connections
+        self.pool_maxsize: int = pool_maxsize
+        self.timeout: float | tuple[float, float] = timeout
+        self.keep_alive: bool = keep_alive
+        self.compress: bool = compress
+        self.connectivity: ConnectivityTracker = (
+            connectivity if connectivity is not None else ConnectivityTracker()
+        )
+        self.rate_limiter: RateLimiter = (
+            rate_limiter if rate_limiter is not None else RateLimiter()
+        )
+        self.codec: JSONCodec = (
+            codec if isinstance(codec, JSONCodec) else get_codec(codec)
+        )
+        self.session: requests.Session | None = None
+        self.adapter: HTTPAdapter | None = None
+        self.observers: list[RequestObserver] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._owner: int | None = None
+
+    def add_observer(self, observer: RequestObserver) -> RequestObserver:
+        self.observers.append(observer)
+        return observer
+
+    def remove_observer(self, observer: RequestObserver) -> None:
+        self.observers.remove(observer)
+
+    def open(self) -> requests.Session:
+        if self.session is None:
+            with self._lock:
+                if self.session is None:
+                    self.session = self._new_session()
+                    self._owner = threading.get_ident()
+        session = self.session
+        if self._owner == threading.get_ident() or not isinstance(
+            session, requests.Session
+        ):
+            return session
+        # Other threads get their own Session on top of the same pool and cookies
+        forked = getattr(self._local, "session", None)
+        if forked is None or forked[0] is not session:
+            forked = (session, _fork(session))
+            self._local.session = forked
+        return forked[1]
+
+    def _new_session(self) -> requests.Session:
+        check_eula()
+        session = requests.Session()
+        self.adapter = HTTPAdapter(
+            pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize
+        )
+        session.mount("https://", self.adapter)
+        session.mount("http://", self.adapter)
+        session.headers["Accept-Encoding"] = (
+            DEFAULT_ACCEPT_ENCODING if self.compress else "identity"
+        )
+        session.headers["Connection"] = "keep-alive" if self.keep_alive else "close"
+        return session
+
+    def close(self) -> None:
+        with self._lock:
+            if self.session is not None:
+                self.session.close()
+            self.session = None
+            self.adapter = None
+            self._owner = None
+
+    def url(self, path: str) -> str:
+        if "://" in path:
+            return path
+        return self.api_url + path
+
+    def request(
+        self,
+        route: Route | str,
+        path: str | None = None,
+        retry: RetryPolicy | None = None,
+        deadline: Deadline | None = None,
+        **kwargs,
+    ) -> requests.Response:
+        if not isinstance(route, Route):
+            route = Route(route, path)
+        session = self.open()
+        timeout = kwargs.pop("timeout", self.timeout)
+        if "json" in kwargs:
+            kwargs["data"] = self.codec.dumps(kwargs.pop("json"))
+            kwargs["headers"] = {
+                **(kwargs.get("headers") or {}),
+                "Content-Type": "application/json",
+            }
+        # Looked up by name so a replaced session.get/post is honoured
+        send = getattr(session, route.method.lower())
+        url = self.url(route.path)
+        body = kwargs.get("data")
+        # Streamed bodies are rewound for every retry
+        rewind = body.tell() if hasattr(body, "seek") else None
+        limited = attempt = 0
+        while True:
+            if rewind is not None:
+                body.seek(rewind)
+            if deadline is not None:
+                deadline.ensure(self.rate_limiter.delay(route))
+            self.rate_limiter.acquire(route)
+            # Each attempt gets at most what is left of the overall budget
+            kwargs["timeout"] = timeout if deadline is None else deadline.clamp(timeout)
+            info = (
+                self._start(route, url, limited + attempt, kwargs)
+                if self.observers
+                else None
+            )
+            try:
+                response = self.connectivity.call(send, url, **kwargs)
+            except CircuitOpenError as error:
+                self._end(info, error=error)
+                raise
+            except (requests.ConnectionError, requests.Timeout) as error:
+                self._end(info, error=error)
+                if deadline is not None and deadline.expired():
+                    raise DeadlineExceeded(
+                        f"Deadline of {deadline.timeout}s exceeded"
+                    ) from error
+                if retry is None or not retry.can_retry(attempt):
+                    raise
+                retry.wait(attempt, deadline)
+                attempt += 1
+                continue
+            except BaseException as error:
+                # Observers see every started request end, whatever went wrong
+                self._end(info, error=error)
+                raise
+            self._end(info, response=response, stream=kwargs.get("stream", False))
+            retry_after = self.rate_limiter.update(route, response)
+            if retry_after is not None and limited < self.rate_limiter.max_retries:
+                limited += 1
+                continue
+            if (
+                retry is not None
+                and retry.retry_status(response.status_code)
+                and retry.can_retry(attempt)
+            ):
+                retry.wait(attempt, deadline)
+                attempt += 1
+                continue
+            return response
+
+    def _start(self, route: Route, url: str, attempt: int, kwargs: dict) -> RequestInfo:
+        data = kwargs.get("data")
+        info = RequestInfo(
+            route.method,
+            route.template,
+            url,
+            attempt,
+            (
+                len(data)
+                if isinstance(data, (bytes, bytearray, str, MultipartBody))
+                else 0
+            ),
+        )
+        info.started = time.perf_counter()
+        for observer in self.observers:
+            observer.on_request_start(info)
+        return info
+
+    def _end(
+        self,
+        info: RequestInfo | None,
+        response: requests.Response | None = None,
+        error: BaseException | None = None,
+        stream: bool = False,
+    ) -> None:
+        if info is None:
+            return
+        info.duration = time.perf_counter() - info.started
+        info.error = error
+        if response is not None:
+            info.status = response.status_code
+            info.response_bytes = _response_size(response, stream)
+        for observer in self.observers:
+            observer.on_request_end(info)
+
+    def decode(self, response: requests.Response):
+        content = getattr(response, "content", None)
+        if not isinstance(content, (bytes, bytearray)):
+            # Not a requests response (test doubles), let it decode itself
+            return response.json()
+        return self.codec.loads(content)
+
+    def decode_dms(self, response: requests.Response) -> list[Channel]:
+        content = getattr(response, "content", None)
+        if not isinstance(content, (bytes, bytearray)):
+            return [Channel.from_json(channel) for channel in response.json()]
+        return self.codec.decode_dms(content)
+
+    def stats(self) -> dict[str, int]:
+        connections = 0
+        sent = 0
+        if self.adapter is not None:
+            pools = self.adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                try:
+                    pool = pools[key]
+                except KeyError:  # pragma: no cover
+                    continue
+                connections += pool.num_connections
+                sent += pool.num_requests
+        return {
+            "requests": sent,
+            "connections": connections,
+            "reused": max(sent - connections, 0),
+        }
+
+
+def _response_size(response: requests.Response, stream: bool) -> int | None:
+    headers = getattr(response, "headers", None)
+    if isinstance(headers, Mapping) and headers.get("Content-Length", "").isdigit():
+        return int(headers["Content-Length"])
+    if stream:
+        # Reading the body here would consume the stream
+        return None
+    content = getattr(response, "content", None)
+    if isinstance(content, (bytes, bytearray)):
+        return len(content)
+    return None
+
+
+def _fork(session: requests.Session) -> requests.Session:
+    forked = requests.Session()
+    forked.adapters = session.adapters
+    forked.cookies = session.cookies
+    forked.headers = session.headers
+    forked.auth = session.auth
+    forked.proxies = session.proxies
+    forked.verify = session.verify
+    forked.cert = session.cert
+    return forked
@@ -1,10 +1,25 @@
+import asyncio
+import io
+import json
+import os
+import pstats
+import queue
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
 from unittest import mock
 
 import pytest
 import requests
 
-from discord_sender import (channel, discord, discord_exceptions, info, other,
-                            tools)
+from discord_sender import (bench, cache, channel, codec, config, connection,
+                            deadline, discord, discord_exceptions, gateway,
+                            hooks, info, multipart, other, ratelimit, retry,
+                            sender, singleflight, stub, tools, tracker)
+from discord_sender.__main__ import main
 from discord_sender.other import OtherUser
 
 
@@ -217,11 +232,16 @@ class TestDefaults:
         def g():
             return "WORKS"
 
-        if internet_connection():
-            assert discord.patch_get(g)() == g()
-        else:
-            with pytest.raises(requests.ConnectionError, match="Internet not connected"):
-                discord.patch_get(g)()
+        assert discord.patch_get(g)() == g()
+
+        def offline():
+            raise requests.ConnectionError("offline")
+
+        tracker = connection.ConnectivityTracker(failure_threshold=1)
+        with pytest.raises(requests.ConnectionError, match="offline"):
+            discord.patch_get(offline, tracker)()
+        with pytest.raises(requests.ConnectionError, match="Internet not connected"):
+            discord.patch_get(g, tracker)()
 
     def test_default_duser(self, user):
         assert user.user_info is None
@@ -233,6 +253,1749 @@ class TestDefaults:
         assert True
 
 
+class TestImport:
+    @staticmethod
+    def run_fresh(code, home):
+        # A fresh interpreter with an empty home, stdin closed so a prompt would fail
+        return subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            env={**os.environ, "HOME": str(home), "USERPROFILE": str(home)},
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+
+    @staticmethod
+    def import_times(stderr):
+        times = {}
+        for line in stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line[len("import time:") :].split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative) / 1e6
+        return times
+
+    def test_no_side_effects(self, tmp_path):
+        result = self.run_fresh(
+            "import discord_sender.discord, discord_sender.tracker", tmp_path
+        )
+        assert result.returncode == 0, result.stdout + result.stderr
+        assert result.stdout == ""
+        assert os.listdir(tmp_path) == []
+
+    def test_models_skip_requests(self, tmp_path):
+        result = self.run_fresh(
+            "import discord_sender.channel, discord_sender.other, discord_sender.info",
+            tmp_path,
+        )
+        assert result.returncode == 0, result.stderr
+        times = self.import_times(result.stderr)
+        assert "discord_sender.channel" in times
+        assert "requests" not in times
+        assert times["discord_sender"] < 0.5
+
+    def test_eula_checked_on_first_use(self, tmp_path, monkeypatch):
+        monkeypatch.setitem(config.CONFIG, "other", str(tmp_path / "cfg"))
+        monkeypatch.setitem(config.CONFIG, "nt", str(tmp_path / "cfg"))
+        monkeypatch.setattr(config, "_eula_checked", False)
+        monkeypatch.setattr(sys, "argv", ["worker"])
+        answers = mock.Mock(return_value="y")
+        monkeypatch.setattr("builtins.input", answers)
+        discord.Transport().open()
+        discord.Transport().open()
+        assert answers.call_count == 1
+        assert os.path.exists(config.eula_path())
+
+    def test_eula_declined(self, tmp_path, monkeypatch):
+        monkeypatch.setitem(config.CONFIG, "other", str(tmp_path / "cfg"))
+        monkeypatch.setitem(config.CONFIG, "nt", str(tmp_path / "cfg"))
+        monkeypatch.setattr(config, "_eula_checked", False)
+        monkeypatch.setattr(sys, "argv", ["worker"])
+        monkeypatch.setattr("builtins.input", lambda prompt: "n")
+        with pytest.raises(SystemExit):
+            discord.Transport().open()
+        assert not os.path.exists(config.eula_path())
+
+    def test_eula_not_asked_off_the_main_thread(self, tmp_path, monkeypatch):
+        monkeypatch.setitem(config.CONFIG, "other", str(tmp_path / "cfg"))
+        monkeypatch.setitem(config.CONFIG, "nt", str(tmp_path / "cfg"))
+        monkeypatch.setattr(config, "_eula_checked", False)
+        monkeypatch.setattr(sys, "argv", ["worker"])
+        answers = mock.Mock(return_value="y")
+        monkeypatch.setattr("builtins.input", answers)
+        with ThreadPoolExecutor(1) as pool:
+            opened = pool.submit(discord.Transport().open)
+            with pytest.raises(
+                discord_exceptions.EulaNotAcceptedError, match="--accept-eula"
+            ):
+                opened.result()
+        with pytest.raises(discord_exceptions.EulaNotAcceptedError):
+            config.check_eula(interactive=False)
+        answers.assert_not_called()
+        discord.Transport().open()
+        assert answers.call_count == 1
+
+
+class TestConnectivity:
+    @staticmethod
+    def offline():
+        raise requests.ConnectionError("offline")
+
+    def test_opens_after_threshold(self):
+        tracker = connection.ConnectivityTracker(failure_threshold=2)
+        for _ in range(2):
+            assert tracker.healthy()
+            with pytest.raises(requests.ConnectionError, match="offline"):
+                tracker.call(self.offline)
+        assert not tracker.healthy()
+        with pytest.raises(connection.CircuitOpenError):
+            tracker.call(lambda: "WORKS")
+
+    def test_success_resets_failures(self):
+        tracker = connection.ConnectivityTracker(failure_threshold=2)
+        with pytest.raises(requests.ConnectionError):
+            tracker.call(self.offline)
+        assert tracker.call(lambda: "WORKS") == "WORKS"
+        assert tracker.failures == 0
+        with pytest.raises(requests.ConnectionError):
+            tracker.call(self.offline)
+        assert tracker.healthy()
+
+    def test_probe_after_backoff(self):
+        now = [0.0]
+        tracker = connection.ConnectivityTracker(
+            failure_threshold=1, backoff=1, clock=lambda: now[0]
+        )
+        with pytest.raises(requests.ConnectionError):
+            tracker.call(self.offline)
+        now[0] = 0.5
+        with pytest.raises(connection.CircuitOpenError):
+            tracker.call(lambda: "WORKS")
+        now[0] = 1.5
+        with pytest.raises(requests.ConnectionError, match="offline"):
+            tracker.call(self.offline)
+        assert tracker.backoff == 2
+        now[0] = 3.0
+        with pytest.raises(connection.CircuitOpenError):
+            tracker.call(lambda: "WORKS")
+        now[0] = 3.5
+        assert tracker.call(lambda: "WORKS") == "WORKS"
+        assert tracker.healthy()
+        assert tracker.backoff == 1
+
+    def test_other_errors_do_not_count(self):
+        tracker = connection.ConnectivityTracker(failure_threshold=1)
+        with pytest.raises(ValueError):
+            tracker.call(mock.Mock(side_effect=ValueError))
+        assert tracker.healthy()
+
+    def test_interrupted_probe_frees_the_slot(self):
+        now = [0.0]
+        tracker = connection.ConnectivityTracker(
+            failure_threshold=1, backoff=1, clock=lambda: now[0]
+        )
+        with pytest.raises(requests.ConnectionError):
+            tracker.call(self.offline)
+        now[0] = 1.5
+        with pytest.raises(KeyboardInterrupt):
+            tracker.call(mock.Mock(side_effect=KeyboardInterrupt))
+        assert tracker.state == tracker.OPEN
+        now[0] = 3.0
+        assert tracker.call(lambda: "WORKS") == "WORKS"
+        assert tracker.healthy()
+
+
+def logged_in_user(payload, **kwargs):
+    user = discord.DiscordUser(**kwargs)
+    user.session = mock.Mock()
+    with pytest.warns(UserWarning):
+        user._set_logged_in(True)
+    user.user_info = info.DiscordLoginInfo(token="1")
+    resp = mock.Mock()
+    resp.json.return_value = payload
+    resp.ok = True
+    user.session.get.return_value = resp
+    return user
+
+
+DMS = [
+    {"id": "1", "recipients": [{"id": "10", "username": "ten"}], "type": 1},
+    {"id": "2", "recipients": [{"id": "20", "username": "twenty"}], "type": 1},
+    {
+        "id": "3",
+        "recipients": [{"id": "10", "username": "ten"}, {"id": "30"}],
+        "type": 3,
+        "name": "group",
+    },
+]
+
+
+class TestLazyDms:
+    def test_lazy_recipients(self):
+        chan = channel.Channel.from_json(DMS[2])
+        assert chan._recipients is None
+        assert chan.recipient_ids() == ["10", "30"]
+        assert chan._recipients is None
+        assert list(chan.to) == ["ten", None]
+        assert chan.recipients == [OtherUser("10", "ten"), OtherUser("30")]
+        assert chan.recipient_ids() == ["10", "30"]
+        assert chan == channel.Channel(
+            "3", [OtherUser("10", "ten"), OtherUser("30")], 3
+        )
+
+    def test_json_array_chunks(self):
+        data = b'[{"id": "1"}, {"id": "2", "n": 12}, 3]'
+        chunks = [data[i : i + 3] for i in range(0, len(data), 3)]
+        assert list(tools.iter_json_array(chunks)) == [
+            {"id": "1"},
+            {"id": "2", "n": 12},
+            3,
+        ]
+        assert list(tools.iter_json_array([b" [ ] "])) == []
+        with pytest.raises(ValueError):
+            list(tools.iter_json_array([b'[{"id": "1"}']))
+        with pytest.raises(ValueError):
+            list(tools.iter_json_array([b'{"id": "1"}']))
+
+    def test_iter_dms_is_lazy(self):
+        user = logged_in_user([])
+        resp = json_response([])
+        body = b"[%b]" % b",".join(
+            b'{"id": "%d", "recipients": [], "type": 1}' % n for n in range(3)
+        )
+        pulled = []
+
+        def iter_content(chunk_size):
+            for start in range(0, len(body), 10):
+                pulled.append(start)
+                yield body[start : start + 10]
+
+        resp.iter_content = iter_content
+        user.session.get.return_value = resp
+        dms = user.iter_dms()
+        assert next(dms).channel_id == "0"
+        assert len(pulled) < len(body) // 10
+        assert [dm.channel_id for dm in dms] == ["1", "2"]
+        assert user.session.get.call_args.kwargs["stream"] is True
+        resp.close.assert_called_once()
+
+    def test_iter_dms_stub(self, stub_user):
+        assert list(stub_user.iter_dms(chunk_size=7)) == stub_user.get_dms(True)
+
+
+class TestCodecs:
+    @pytest.mark.parametrize("name", ["json", "orjson", "msgspec"])
+    def test_roundtrip(self, name):
+        if name not in codec.available_codecs():
+            pytest.skip(f"{name} is not installed")
+        backend = codec.get_codec(name)
+        data = backend.dumps(DMS)
+        assert isinstance(data, bytes)
+        assert backend.loads(data) == DMS
+        dms = backend.decode_dms(data)
+        assert dms == discord.parse_dms(DMS)
+        assert [dm.name for dm in dms] == [None, None, "group"]
+        assert dms[2].recipients[0].username == "ten"
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            codec.get_codec("yaml")
+        assert codec.get_codec().name == codec.available_codecs()[-1]
+
+    def test_transport_encodes(self):
+        transport = discord.Transport(codec="json")
+        transport.session = mock.Mock()
+        transport.request("POST", "/x", headers={"A": "b"}, json={"k": 1})
+        kwargs = transport.session.post.call_args.kwargs
+        assert kwargs["data"] == b'{"k":1}'
+        assert kwargs["headers"] == {"A": "b", "Content-Type": "application/json"}
+        resp = mock.Mock()
+        resp.content = b'[{"id": "1", "recipients": [], "type": 1}]'
+        assert transport.decode_dms(resp) == [channel.Channel("1", [])]
+
+
+class TestChannelCache:
+    @staticmethod
+    def channels():
+        return [
+            channel.Channel("1", [OtherUser("10", "ten")]),
+            channel.Channel("2", [OtherUser("20", "twenty")]),
+            channel.Channel("3", [OtherUser("10", "ten"), OtherUser("30")], 3),
+        ]
+
+    def test_indexes(self):
+        chans = cache.ChannelCache()
+        chans.fill(self.channels())
+        assert len(chans) == 3
+        assert chans.channel("2").channel_id == "2"
+        assert chans.user("30").user_id == "30"
+        assert chans.user_by_username("ten").user_id == "10"
+        assert chans.dm_channel("10").channel_id == "1"
+        assert chans.dm_channel("30") is None
+        assert chans.channel("4") is None
+
+    def test_ttl(self):
+        now = [0.0]
+        chans = cache.ChannelCache(ttl=10, clock=lambda: now[0])
+        assert not chans.fresh()
+        chans.fill(self.channels())
+        assert chans.fresh()
+        now[0] = 11
+        assert not chans.fresh()
+
+    def test_invalidate(self):
+        chans = cache.ChannelCache()
+        chans.fill(self.channels())
+        chans.invalidate()
+        assert not chans.fresh()
+        assert len(chans) == 0
+        assert chans.user("10") is None
+
+    def test_lru_eviction(self):
+        chans = cache.ChannelCache(max_size=2)
+        chans.fill(self.channels()[:2])
+        assert chans.complete
+        chans.channel("1")
+        chans.add(self.channels()[2])
+        assert not chans.complete
+        assert "2" not in chans
+        assert chans.user("20") is None
+        assert chans.user_by_username("twenty") is None
+        assert chans.user("10").username == "ten"
+        assert chans.dm_channel("10").channel_id == "1"
+
+    def test_lookups_hit_cache(self):
+        user = logged_in_user(DMS)
+        with pytest.warns(UserWarning):
+            assert user.get_channel_info("3").name == "group"
+            assert user.get_user_info_by_id("20").username == "twenty"
+            assert user.get_user_info_by_username("ten").user_id == "10"
+            assert user.get_channel_info("4") is None
+        assert user.session.get.call_count == 1
+        user.channel_cache.invalidate()
+        with pytest.warns(UserWarning):
+            assert user.get_channel_info("1").channel_id == "1"
+        assert user.session.get.call_count == 2
+
+    def test_evicted_lookup_falls_back(self):
+        user = logged_in_user(DMS, cache_size=1)
+        with pytest.warns(UserWarning):
+            assert user.get_channel_info("1").channel_id == "1"
+        # The listing that refreshed the stale cache is scanned, not fetched again
+        assert user.session.get.call_count == 1
+        with pytest.warns(UserWarning):
+            assert user.get_channel_info("4") is None
+        assert user.session.get.call_count == 2
+
+
+def json_response(payload, ok=True, status_code=200):
+    resp = mock.Mock()
+    resp.json.return_value = payload
+    resp.ok = ok
+    resp.status_code = status_code
+    return resp
+
+
+class TestChannelIds:
+    def test_memoized(self):
+        user = logged_in_user([])
+        user.session.post.return_value = json_response({"id": "99"})
+        assert user.get_channel_id("10") == "99"
+        assert user.get_channel_id("10") == "99"
+        assert user.session.post.call_count == 1
+
+    def test_persisted(self, tmp_path):
+        path = str(tmp_path / "channels.json")
+        store = cache.ChannelIdMap(path)
+        store.set("10", "99")
+        assert oct(os.stat(path).st_mode & 0o777) == oct(0o600)
+        assert cache.ChannelIdMap(path).get("10") == "99"
+        store.discard("10")
+        assert "10" not in cache.ChannelIdMap(path)
+
+    def test_corrupt_store(self, tmp_path):
+        path = tmp_path / "channels.json"
+        path.write_text("{not json")
+        assert len(cache.ChannelIdMap(str(path))) == 0
+
+    def test_invalidated_on_unknown_channel(self):
+        user = logged_in_user([])
+        user.channel_ids.set("10", "98")
+        user.session.post.side_effect = [
+            json_response({"code": 10003}, ok=False, status_code=404),
+            json_response({"id": "99"}),
+            json_response({"id": "1"}),
+        ]
+        user.send_message_to_user("hi", "10")
+        assert user.channel_ids.get("10") == "99"
+        urls = [call.args[0] for call in user.session.post.call_args_list]
+        assert urls[0].endswith("/channels/98/messages")
+        assert urls[1].endswith("/users/@me/channels")
+        assert urls[2].endswith("/channels/99/messages")
+
+
+class TestTransport:
+    def test_urls(self):
+        transport = discord.Transport(base_url="http://localhost:1/")
+        assert transport.url("/users/@me") == "http://localhost:1/api/v9/users/@me"
+        assert transport.url("http://x/login") == "http://x/login"
+
+    def test_session_config(self):
+        transport = discord.Transport(pool_maxsize=3, compress=False)
+        session = transport.open()
+        assert transport.open() is session
+        assert session.get_adapter("https://discord.com") is transport.adapter
+        assert transport.adapter._pool_maxsize == 3
+        assert session.headers["Accept-Encoding"] == "identity"
+        assert session.headers["Connection"] == "keep-alive"
+        assert transport.stats() == {"requests": 0, "connections": 0, "reused": 0}
+        transport.close()
+        assert transport.session is None
+
+    def test_default_timeout(self):
+        transport = discord.Transport(timeout=(1, 2))
+        transport.session = mock.Mock()
+        transport.request("GET", "/users/@me")
+        assert transport.session.get.call_args.kwargs["timeout"] == (1, 2)
+        transport.request("GET", "/users/@me", timeout=7)
+        assert transport.session.get.call_args.kwargs["timeout"] == 7
+
+    def test_user_shares_transport(self):
+        transport = discord.Transport()
+        user = discord.DiscordUser(transport=transport)
+        assert user.connectivity is transport.connectivity
+        user.session = mock.Mock()
+        user.session.get.return_value = json_response({"id": "1"})
+        user.login_with_token("token")
+        assert user.session.get.call_args.args[0] == (
+            "https://discord.com/api/v9/users/@me"
+        )
+
+
+@pytest.fixture()
+def stub_server():
+    server = stub.StubDiscordServer(
+        channels=[
+            {
+                "id": "300",
+                "type": 1,
+                "recipients": [{"id": "10", "username": "ten"}],
+            },
+            {
+                "id": "301",
+                "type": 3,
+                "name": "group",
+                "recipients": [{"id": "10", "username": "ten"}, {"id": "20"}],
+            },
+        ],
+        users={"30": {"id": "30", "username": "thirty"}},
+    )
+    with server:
+        yield server
+
+
+@pytest.fixture()
+def stub_user(stub_server):
+    with discord.DiscordUser(
+        transport=discord.Transport(base_url=stub_server.url)
+    ) as user:
+        yield user.login_with_token(stub.STUB_TOKEN)
+
+
+def limited_response(status_code=200, headers=None, payload=None):
+    resp = json_response(payload or {}, status_code < 400, status_code)
+    resp.headers = requests.structures.CaseInsensitiveDict(headers or {})
+    return resp
+
+
+class TestRateLimits:
+    @staticmethod
+    def limiter():
+        now = [0.0]
+        slept = []
+
+        def sleep(delay):
+            slept.append(delay)
+            now[0] += delay
+
+        return ratelimit.RateLimiter(clock=lambda: now[0], sleep=sleep), slept
+
+    def test_route(self):
+        route = ratelimit.Route("post", "/channels/{channel_id}/messages", channel_id="5")
+        assert route.path == "/channels/5/messages"
+        assert route.key == "POST /channels/{channel_id}/messages"
+        assert route.major == "5"
+
+    def test_waits_for_empty_bucket(self):
+        limiter, slept = self.limiter()
+        route = ratelimit.Route("POST", "/channels/{channel_id}/messages", channel_id="5")
+        other_channel = ratelimit.Route(
+            "POST", "/channels/{channel_id}/messages", channel_id="6"
+        )
+        headers = {
+            "X-RateLimit-Bucket": "abc",
+            "X-RateLimit-Limit": "5",
+            "X-RateLimit-Remaining": "0",
+            "X-RateLimit-Reset-After": "2.5",
+        }
+        assert limiter.update(route, limited_response(headers=headers)) is None
+        assert limiter.state()["buckets"]["abc:5"]["reset_after"] == 2.5
+        assert limiter.acquire(other_channel) == 0
+        assert limiter.acquire(route) == 2.5
+        assert slept == [2.5]
+
+    def test_counts_down_remaining(self):
+        limiter, slept = self.limiter()
+        route = ratelimit.Route("GET", "/users/@me/channels")
+        headers = {"X-RateLimit-Remaining": "1", "X-RateLimit-Reset-After": "1"}
+        limiter.update(route, limited_response(headers=headers))
+        limiter.acquire(route)
+        limiter.acquire(route)
+        assert slept == [1]
+
+    def test_refills_after_reset(self):
+        limiter, slept = self.limiter()
+        route = ratelimit.Route("GET", "/users/@me/channels")
+        headers = {
+            "X-RateLimit-Limit": "2",
+            "X-RateLimit-Remaining": "0",
+            "X-RateLimit-Reset-After": "1",
+        }
+        limiter.update(route, limited_response(headers=headers))
+        waited = [limiter.acquire(route) for _ in range(10)]
+        # Every window lets the limit through, the rest waits for the next one
+        assert waited == [1, 0] * 5
+        assert slept == [1] * 5
+
+    def test_concurrent_callers_share_remaining(self):
+        limiter = ratelimit.RateLimiter()
+        route = ratelimit.Route("GET", "/users/@me/channels")
+        headers = {"X-RateLimit-Remaining": "5", "X-RateLimit-Reset-After": "0.2"}
+        limiter.update(route, limited_response(headers=headers))
+        start = threading.Barrier(20)
+
+        def call(_):
+            start.wait()
+            return limiter.acquire(route)
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            with ThreadPoolExecutor(20) as pool:
+                waited = list(pool.map(call, range(20)))
+        finally:
+            sys.setswitchinterval(interval)
+        assert waited.count(0) == 5
+
+    def test_global_limit(self):
+        limiter, slept = self.limiter()
+        route = ratelimit.Route("GET", "/users/@me")
+        resp = limited_response(
+            429, {"Retry-After": "3", "X-RateLimit-Global": "true"}, {"global": True}
+        )
+        assert limiter.update(route, resp) == 3
+        assert limiter.state()["global_reset_after"] == 3
+        limiter.acquire(ratelimit.Route("GET", "/users/@me/channels"))
+        assert slept == [3]
+
+    def test_ignores_mocks(self):
+        limiter, slept = self.limiter()
+        assert limiter.update(ratelimit.Route("GET", "/"), mock.Mock()) is None
+        assert limiter.state()["buckets"] == {}
+
+    def test_transport_retries_429(self):
+        limiter, slept = self.limiter()
+        transport = discord.Transport(rate_limiter=limiter)
+        transport.session = mock.Mock()
+        transport.session.get.side_effect = [
+            limited_response(429, payload={"retry_after": 0.5, "global": False}),
+            limited_response(200),
+        ]
+        assert transport.request("GET", "/users/@me").status_code == 200
+        assert slept == [0.5]
+
+    def test_gives_up(self):
+        limiter, slept = self.limiter()
+        limiter.max_retries = 1
+        user = logged_in_user([])
+        user.transport.rate_limiter = limiter
+        user.session.post.return_value = limited_response(
+            429, {"Retry-After": "1"}, {"retry_after": 1, "global": False}
+        )
+        with pytest.raises(discord_exceptions.RateLimitedError) as error:
+            user.send_message_to_channel("hi", "5")
+        assert error.value.retry_after == 1
+        assert user.session.post.call_count == 2
+        assert user.rate_limits()["buckets"]["POST /channels/{channel_id}/messages:5"]
+
+
+class TestRetries:
+    @staticmethod
+    def policy(attempts=3):
+        slept = []
+        return (
+            retry.RetryPolicy(attempts=attempts, rng=lambda: 0.5, sleep=slept.append),
+            slept,
+        )
+
+    def test_backoff(self):
+        policy = retry.RetryPolicy(base=1, cap=5, jitter=False)
+        assert [policy.delay(n) for n in range(4)] == [1, 2, 4, 5]
+        policy = retry.RetryPolicy(base=1, cap=5, rng=lambda: 0.25)
+        assert policy.delay(2) == 1
+
+    def test_nonces_unique(self):
+        nonces = {tools.make_nonce() for _ in range(1000)}
+        assert len(nonces) == 1000
+        assert all(nonce.isdigit() for nonce in nonces)
+
+    def test_send_retried_with_same_nonce(self):
+        policy, slept = self.policy()
+        user = logged_in_user([], retry_policy=policy)
+        user.session.post.side_effect = [
+            requests.ConnectionError("reset"),
+            json_response({}, ok=False, status_code=503),
+            json_response({"id": "1"}),
+        ]
+        user.send_message_to_channel("hi", "5")
+        payloads = [
+            json.loads(call.kwargs["data"]) for call in user.session.post.call_args_list
+        ]
+        assert len(payloads) == 3
+        assert payloads[0]["enforce_nonce"] is True
+        assert len({payload["nonce"] for payload in payloads}) == 1
+        assert slept == [0.25, 0.5]
+
+    def test_gives_up(self):
+        policy, slept = self.policy(attempts=1)
+        user = logged_in_user([], retry_policy=policy)
+        user.session.post.side_effect = requests.ConnectionError("reset")
+        with pytest.raises(requests.ConnectionError):
+            user.send_message_to_channel("hi", "5")
+        assert user.session.post.call_count == 2
+
+    def test_client_errors_not_retried(self):
+        policy, slept = self.policy()
+        user = logged_in_user([], retry_policy=policy)
+        user.session.post.return_value = json_response(
+            {"code": 50001}, ok=False, status_code=403
+        )
+        with pytest.raises(discord_exceptions.InvalidCredentialsException):
+            user.send_message_to_channel("hi", "5")
+        assert user.session.post.call_count == 1
+
+    def test_stub_deduplicates(self, stub_server, stub_user):
+        stub_user.send_message_to_channel("once", "300", nonce="42")
+        stub_user.send_message_to_channel("once", "300", nonce="42")
+        assert len(stub_server.messages["300"]) == 1
+
+
+class TestSendQueue:
+    def test_order_and_results(self):
+        sends = sender.SendQueue()
+        seen = []
+        futures = [sends.submit(seen.append, n) for n in range(50)]
+        assert [future.result(5) for future in futures] == [None] * 50
+        assert seen == list(range(50))
+        sends.close()
+
+    def test_exceptions_reach_future(self):
+        sends = sender.SendQueue()
+        future = sends.submit(mock.Mock(side_effect=ValueError("boom")))
+        with pytest.raises(ValueError, match="boom"):
+            future.result(5)
+        sends.close()
+
+    def test_backpressure(self):
+        started = threading.Event()
+        gate = threading.Event()
+        sends = sender.SendQueue(maxsize=1)
+        first = sends.submit(lambda: started.set() or gate.wait())
+        started.wait(5)
+        sends.submit(lambda: None)
+        with pytest.raises(queue.Full):
+            sends.submit(lambda: None, block=False)
+        gate.set()
+        first.result(5)
+        sends.close()
+
+    def test_flush_on_close(self):
+        sends = sender.SendQueue()
+        seen = []
+        for n in range(20):
+            sends.submit(seen.append, n)
+        sends.close()
+        assert seen == list(range(20))
+        assert sends.closed()
+        with pytest.raises(RuntimeError):
+            sends.submit(seen.append, 1)
+
+    def test_close_during_submit(self):
+        sends = sender.SendQueue()
+        put = sends._queue.put
+        closer = threading.Thread(target=sends.close)
+
+        def slow_put(*args):
+            # close() runs between the closed check and the put
+            sends._queue.put = put
+            closer.start()
+            time.sleep(0.05)
+            put(*args)
+
+        sends._queue.put = slow_put
+        future = sends.submit(lambda: "sent")
+        closer.join(5)
+        assert future.result(timeout=1) == "sent"
+
+    def test_user_queue(self, stub_server):
+        with discord.DiscordUser(
+            transport=discord.Transport(base_url=stub_server.url)
+        ) as user:
+            with pytest.raises(discord_exceptions.InvalidCredentialsException):
+                user.enqueue_send("", "300")
+            user.login_with_token(stub.STUB_TOKEN)
+            futures = [
+                user.send_message_to_channel_async(str(n), "300") for n in range(10)
+            ]
+            missing = user.enqueue_send("lost", "999")
+            assert futures[-1].result(5) is user
+            with pytest.raises(discord_exceptions.ChannelNotFoundError):
+                missing.result(5)
+        contents = [msg["content"] for msg in stub_server.messages["300"]]
+        assert contents == [str(n) for n in range(10)]
+
+
+class TestDMTracker:
+    def test_refresh_reports_changes(self, stub_server, stub_user):
+        dms = tracker.DMTracker(stub_user)
+        events = []
+        dms.on_new(lambda chan: events.append(("new", chan.channel_id)))
+        dms.on_closed(lambda chan: events.append(("closed", chan.channel_id)))
+        dms.on_changed(
+            lambda old, new: events.append(("changed", old.name, new.name))
+        )
+        diff = dms.refresh()
+        assert len(diff.added) == 2
+        assert events == []
+        kept = dms.channels["300"]
+
+        stub_server.channels[1] = dict(stub_server.channels[1], name="renamed")
+        stub_server.dm_channel("30")
+        del stub_server.channels[0]
+        dms.refresh()
+        assert sorted(events) == [
+            ("changed", "group", "renamed"),
+            ("closed", "300"),
+            ("new", stub_server.channels[-1]["id"]),
+        ]
+        assert kept not in dms.channels.values()
+
+        events.clear()
+        unchanged = dms.channels["301"]
+        assert dms.refresh() == ([], [], [])
+        assert events == []
+        assert dms.channels["301"] is unchanged
+        assert unchanged._raw_recipients is not None
+
+    def test_notify_initial(self):
+        user = mock.Mock()
+        user.iter_dms.return_value = iter(discord.parse_dms(DMS))
+        dms = tracker.DMTracker(user, notify_initial=True)
+        seen = []
+        dms.on_new(seen.append)
+        dms.refresh()
+        assert [chan.channel_id for chan in seen] == ["1", "2", "3"]
+
+
+class TestStubServer:
+    def test_token_flow(self, stub_server, stub_user):
+        assert [dm.channel_id for dm in stub_user.get_dms(True)] == ["300", "301"]
+        stub_user.send_message_to_user("hello", "30")
+        stub_user.send_message_to_user("again", "30")
+        channel_id = stub_user.get_channel_id("30")
+        contents = [msg["content"] for msg in stub_server.messages[channel_id]]
+        assert contents == ["hello", "again"]
+        assert stub_server.requests.count(("POST", "/api/v9/users/@me/channels")) == 1
+        assert stub_user.transport.stats()["reused"] > 0
+
+    def test_credentials(self, stub_server):
+        with discord.DiscordUser(
+            transport=discord.Transport(base_url=stub_server.url)
+        ) as user:
+            with pytest.raises(discord_exceptions.InvalidCredentialsException):
+                user.login_with_credentials(stub_server.email, "wrong")
+            user.login_with_credentials(stub_server.email, stub_server.password)
+            assert user.user_info.uid == stub.STUB_USER_ID
+            assert "__dcfduid" in user.session.cookies
+
+    def test_bad_token(self, stub_server):
+        with discord.DiscordUser(
+            transport=discord.Transport(base_url=stub_server.url)
+        ) as user:
+            with pytest.raises(
+                discord_exceptions.InvalidCredentialsException, match="Invalid Token"
+            ):
+                user.login_with_token("nope")
+
+
+class TestSavedSession:
+    def test_warm_start(self, stub_server, tmp_path):
+        path = str(tmp_path / "session.json")
+        with discord.DiscordUser(
+            transport=discord.Transport(base_url=stub_server.url)
+        ) as user:
+            user.login_with_credentials(stub_server.email, stub_server.password)
+            assert user.save_session(path) == path
+        assert os.stat(path).st_mode & 0o777 == 0o600
+
+        with discord.DiscordUser(
+            transport=discord.Transport(base_url=stub_server.url)
+        ) as warm:
+            before = len(stub_server.requests)
+            assert warm.load_session(path) is True
+            assert len(stub_server.requests) == before
+            assert warm.logged_in()
+            assert warm.user_info.uid == stub.STUB_USER_ID
+            assert warm.session.cookies["__dcfduid"] == "stub"
+            warm.send_message_to_channel("hi", "300")
+        assert stub_server.requests[before:] == [
+            ("POST", "/api/v9/channels/300/messages")
+        ]
+
+    def test_expired_session(self, stub_server, stub_user, tmp_path):
+        path = stub_user.save_session(str(tmp_path / "session.json"))
+        stub_server.token = "rotated"
+        with discord.DiscordUser(
+            transport=discord.Transport(base_url=stub_server.url)
+        ) as user:
+            assert user.load_session(path)
+            with pytest.raises(
+                discord_exceptions.InvalidCredentialsException, match="expired"
+            ):
+                user.send_message_to_channel("hi", "300")
+            assert not user.logged_in()
+        assert stub_server.requests[-1] == ("GET", "/api/v9/users/@me")
+
+    def test_other_401_after_revalidation(self, stub_server, stub_user, tmp_path):
+        path = stub_user.save_session(str(tmp_path / "session.json"))
+        user = discord.DiscordUser(
+            transport=discord.Transport(base_url=stub_server.url)
+        )
+        user.load_session(path)
+        user.session_verified = False
+        user.transport.request = mock.Mock(
+            side_effect=[
+                json_response({"message": "401: Unauthorized", "code": 0}, False, 401),
+                json_response({"id": stub.STUB_USER_ID}),
+            ]
+        )
+        with pytest.raises(discord_exceptions.InvalidCredentialsException):
+            user.send_message_to_channel("hi", "300")
+        assert user.logged_in()
+        assert user.session_verified
+        user.close()
+
+    def test_unusable_files(self, tmp_path):
+        user = discord.DiscordUser()
+        assert user.load_session(str(tmp_path / "missing.json")) is False
+        (tmp_path / "bad.json").write_text("{")
+        assert user.load_session(str(tmp_path / "bad.json")) is False
+        (tmp_path / "other.json").write_text(
+            json.dumps({"token": "t", "base_url": "http://elsewhere"})
+        )
+        assert user.load_session(str(tmp_path / "other.json")) is False
+        assert not user.logged_in()
+        with pytest.raises(discord_exceptions.InvalidCredentialsException):
+            user.save_session(str(tmp_path / "s.json"))
+
+
+class TestThreads:
+    def test_sessions_per_thread(self):
+        transport = discord.Transport()
+        main = transport.open()
+        with ThreadPoolExecutor(1) as pool:
+            other = pool.submit(transport.open).result()
+            assert pool.submit(transport.open).result() is other
+        assert other is not main
+        assert other.adapters is main.adapters
+        assert other.cookies is main.cookies
+        assert transport.open() is main
+
+    def test_login_race(self, stub_server):
+        user = discord.DiscordUser(
+            transport=discord.Transport(base_url=stub_server.url)
+        )
+
+        def login():
+            try:
+                user.login_with_token(stub.STUB_TOKEN)
+                return True
+            except discord_exceptions.AlreadyLoggedInException:
+                return False
+
+        with user, ThreadPoolExecutor(8) as pool:
+            results = [pool.submit(login) for _ in range(8)]
+        assert sum(future.result() for future in results) == 1
+        assert stub_server.requests.count(("GET", "/api/v9/users/@me")) == 1
+
+    def test_shared_user_under_load(self, stub_server):
+        user = discord.DiscordUser(
+            transport=discord.Transport(base_url=stub_server.url, pool_maxsize=8)
+        )
+        user.login_with_token(stub.STUB_TOKEN)
+
+        def work(n):
+            if n % 10 == 0:
+                assert len(user.get_dms(True)) >= 2
+            elif n % 10 == 5:
+                assert user.get_user_info_by_id("10").username == "ten"
+            else:
+                user.send_message_to_channel(str(n), "300" if n % 2 else "301")
+
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(work, range(300)))
+        sent = stub_server.messages["300"] + stub_server.messages["301"]
+        assert sorted(int(message["content"]) for message in sent) == [
+            n for n in range(300) if n % 5
+        ]
+        # Every thread went through the one shared pool
+        assert user.transport.stats()["requests"] == len(stub_server.requests)
+        assert user.transport.stats()["connections"] <= 8
+        user.close()
+
+    def test_cache_under_contention(self):
+        channels = [
+            channel.Channel.from_json(data) for data in stub.synthetic_channels(200)
+        ]
+        cache_ = cache.ChannelCache(max_size=50)
+
+        def work(n):
+            for item in channels[n::8]:
+                cache_.add(item)
+                cache_.user(item.recipients[0].user_id)
+                cache_.dm_channel(item.recipients[0].user_id)
+            cache_.remove(channels[n].channel_id)
+
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(work, range(8)))
+        assert len(cache_) <= 50
+        for user_id in list(cache_._users):
+            assert cache_._user_channels[user_id] <= set(cache_._channels)
+
+    def test_intern_is_atomic(self):
+        with ThreadPoolExecutor(8) as pool:
+            users = list(
+                pool.map(lambda n: OtherUser.intern("777", "race"), range(200))
+            )
+        assert len({id(user) for user in users}) == 1
+
+
+class TestChannelResolution:
+    def test_username_paths(self, stub_server, stub_user):
+        resolution = stub_user.resolve_channel(username="ten")
+        assert resolution == ("300", "10", channel.ChannelResolution.DMS)
+        before = len(stub_server.requests)
+        stub_user.send_message_to_username("hi", "ten")
+        # Warm: just the message itself
+        assert stub_server.requests[before:] == [
+            ("POST", "/api/v9/channels/300/messages")
+        ]
+        assert stub_user.resolve_channel(username="ten").source == "cache"
+
+    def test_username_cold_send(self, stub_server, stub_user):
+        before = len(stub_server.requests)
+        stub_user.send_message_to_username("hi", "ten")
+        assert stub_server.requests[before:] == [
+            ("GET", "/api/v9/users/@me/channels"),
+            ("POST", "/api/v9/channels/300/messages"),
+        ]
+        assert stub_user.send_message_to_username("hi", "nobody") is None
+
+    def test_username_evicted_from_cache(self):
+        with stub.StubDiscordServer(channels=stub.synthetic_channels(10)) as server:
+            with discord.DiscordUser(
+                cache_size=4, transport=discord.Transport(base_url=server.url)
+            ) as user:
+                user.login_with_token(stub.STUB_TOKEN)
+                resolution = user.resolve_channel(username="user1")
+                assert resolution.user_id == server.channels[1]["recipients"][0]["id"]
+                assert user.send_message_to_username("hi", "user1") is user
+                assert user.send_message_to_username("hi", "nobody") is None
+
+    def test_user_id_paths(self, stub_user):
+        metrics = stub_user.add_observer(hooks.MetricsCollector())
+        opened = stub_user.resolve_channel(user_id="30")
+        assert opened.source == channel.ChannelResolution.OPENED
+        assert stub_user.resolve_channel(user_id="30") == opened._replace(
+            source="cache"
+        )
+        stub_user.get_dms(True)
+        assert stub_user.resolve_channel(user_id="10").source == "cache"
+        assert metrics.as_dict()["channel_resolutions"] == {"open": 1, "cache": 2}
+        assert 'discord_sender_channel_resolutions_total{source="open"} 1' in (
+            metrics.prometheus()
+        )
+
+    def test_stale_channel_is_reopened(self, stub_server, stub_user):
+        stub_user.channel_ids.set("10", "999")
+        stub_user.send_message_to_user("hi", "10")
+        assert [message["content"] for message in stub_server.messages["300"]] == ["hi"]
+        assert stub_user.channel_ids.get("10") == "300"
+
+    def test_arguments(self, stub_user):
+        with pytest.raises(discord_exceptions.ArgumentError):
+            stub_user.resolve_channel()
+        with pytest.raises(discord_exceptions.ArgumentError):
+            stub_user.resolve_channel("10", "ten")
+        with pytest.raises(discord_exceptions.UnknownUserException):
+            stub_user.resolve_channel(username="nobody")
+
+    def test_open_errors(self, stub_server, stub_user):
+        with pytest.raises(discord_exceptions.UnknownUserException):
+            stub_user.resolve_channel(user_id="999")
+        stub_user.transport.rate_limiter.max_retries = 0
+        stub_server.rate_limit_every = 1
+        with pytest.raises(discord_exceptions.RateLimitedError):
+            stub_user.resolve_channel(user_id="30")
+        stub_server.rate_limit_every = 0
+        stub_server.token = "rotated"
+        with pytest.raises(discord_exceptions.InvalidCredentialsException):
+            stub_user.resolve_channel(user_id="30")
+
+
+class TestDeadlines:
+    def test_budget(self):
+        now = [0.0]
+        budget = deadline.Deadline(2.0, clock=lambda: now[0])
+        assert budget.clamp((5.0, 30.0)) == (2.0, 2.0)
+        now[0] = 1.5
+        assert budget.clamp(0.2) == 0.2
+        assert budget.clamp(None) == 0.5
+        with pytest.raises(discord_exceptions.DeadlineExceeded):
+            budget.ensure(0.5)
+        now[0] = 2.0
+        with pytest.raises(TimeoutError):
+            budget.check()
+        assert deadline.Deadline.coerce(None) is None
+        assert deadline.Deadline.coerce(budget) is budget
+        assert deadline.Deadline.coerce(3).timeout == 3
+
+    def test_stalled_request(self, stub_server, stub_user):
+        stub_server.latency = 0.5
+        with pytest.raises(discord_exceptions.DeadlineExceeded):
+            stub_user.get_dms(True, deadline=0.1)
+
+    def test_split_across_sub_requests(self, stub_server, stub_user):
+        stub_server.latency = 0.15
+        # Opening the channel fits, the send after it does not
+        with pytest.raises(discord_exceptions.DeadlineExceeded):
+            stub_user.send_message_to_user("hi", "30", deadline=0.25)
+        assert ("POST", "/api/v9/users/@me/channels") in stub_server.requests
+        stub_server.latency = 0
+        stub_user.send_message_to_user("hi", "30", deadline=5)
+
+    def test_no_backoff_past_deadline(self):
+        transport = discord.Transport()
+        transport.session = mock.Mock()
+        transport.session.get.return_value = limited_response(503)
+        sleep = mock.Mock()
+        policy = retry.RetryPolicy(base=10, jitter=False, sleep=sleep)
+        with pytest.raises(discord_exceptions.DeadlineExceeded):
+            transport.request(
+                "GET", "/users/@me", retry=policy, deadline=deadline.Deadline(1)
+            )
+        sleep.assert_not_called()
+        assert transport.session.get.call_args.kwargs["timeout"][1] <= 1
+
+    def test_no_rate_limit_wait_past_deadline(self):
+        transport = discord.Transport()
+        transport.session = mock.Mock()
+        transport.rate_limiter.delay = mock.Mock(return_value=5.0)
+        with pytest.raises(discord_exceptions.DeadlineExceeded):
+            transport.request("GET", "/users/@me", deadline=deadline.Deadline(1))
+        transport.session.get.assert_not_called()
+
+
+class TestSingleFlight:
+    def test_followers_share_the_result(self):
+        flight = singleflight.SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            release.wait(5)
+            return ["dms"]
+
+        with ThreadPoolExecutor(8) as pool:
+            futures = [pool.submit(flight.do, "key", slow) for _ in range(8)]
+            while flight.shared < 7:
+                threading.Event().wait(0.001)
+            release.set()
+            results = [future.result() for future in futures]
+        assert calls == [1]
+        assert all(result is results[0] for result in results)
+        assert len(flight) == 0
+        assert flight.do("key", lambda: "again") == "again"
+
+    def test_followers_share_the_error(self):
+        flight = singleflight.SingleFlight()
+        release = threading.Event()
+
+        def failing():
+            release.wait(5)
+            raise discord_exceptions.ChannelNotFoundError("gone")
+
+        with ThreadPoolExecutor(4) as pool:
+            futures = [pool.submit(flight.do, "key", failing) for _ in range(4)]
+            while flight.shared < 3:
+                threading.Event().wait(0.001)
+            release.set()
+            for future in futures:
+                with pytest.raises(discord_exceptions.ChannelNotFoundError):
+                    future.result()
+
+    def test_follower_deadline(self):
+        flight = singleflight.SingleFlight()
+        release = threading.Event()
+        with ThreadPoolExecutor(1) as pool:
+            leader = pool.submit(flight.do, "key", lambda: release.wait(5))
+            while not len(flight):
+                threading.Event().wait(0.001)
+            with pytest.raises(discord_exceptions.DeadlineExceeded):
+                flight.do("key", lambda: None, deadline.Deadline(0.05))
+            release.set()
+            assert leader.result() is True
+
+    @pytest.mark.parametrize("budget", [None, 5.0])
+    def test_leader_deadline_is_not_shared(self, budget):
+        flight = singleflight.SingleFlight()
+        release = threading.Event()
+
+        def expire():
+            release.wait(5)
+            raise discord_exceptions.DeadlineExceeded("Deadline of 0.1s exceeded")
+
+        follower_deadline = None if budget is None else deadline.Deadline(budget)
+        with ThreadPoolExecutor(2) as pool:
+            leader = pool.submit(flight.do, "key", expire)
+            while not len(flight):
+                threading.Event().wait(0.001)
+            follower = pool.submit(flight.do, "key", lambda: "dms", follower_deadline)
+            while not flight.shared:
+                threading.Event().wait(0.001)
+            release.set()
+            with pytest.raises(discord_exceptions.DeadlineExceeded):
+                leader.result()
+            # Retried as the leader of its own call
+            assert follower.result() == "dms"
+        assert flight.shared == 0
+
+    def test_async_leader_cancelled(self):
+        async def flow():
+            flight = singleflight.AsyncSingleFlight()
+            release = asyncio.Event()
+            calls = []
+
+            async def fetch():
+                calls.append(1)
+                await release.wait()
+                return "dms"
+
+            # The leader's own timeout cancels it
+            first = asyncio.create_task(
+                asyncio.wait_for(flight.do("dms", fetch), 0.01)
+            )
+            while not len(flight):
+                await asyncio.sleep(0)
+            follower = asyncio.create_task(flight.do("dms", fetch))
+            with pytest.raises(asyncio.TimeoutError):
+                await first
+            release.set()
+            assert await follower == "dms"
+            assert calls == [1]
+            await asyncio.sleep(0)
+            assert len(flight) == 0
+
+        asyncio.run(flow())
+
+    def test_threaded_fan_in(self, stub_server, stub_user):
+        stub_server.latency = 0.2
+        start = threading.Barrier(16)
+
+        def work(n):
+            start.wait()
+            if n % 2:
+                return [dm.channel_id for dm in stub_user.get_dms(True)]
+            return stub_user.get_channel_id("30")
+
+        with ThreadPoolExecutor(16) as pool:
+            results = list(pool.map(work, range(16)))
+        # The listing may or may not include the channel opened next to it
+        assert results[1][:2] == ["300", "301"]
+        assert all(result == results[1] for result in results[1::2])
+        assert len(set(results[::2])) == 1
+        assert stub_server.requests.count(("GET", "/api/v9/users/@me/channels")) == 1
+        assert stub_server.requests.count(("POST", "/api/v9/users/@me/channels")) == 1
+        assert stub_user.single_flight.shared == 14
+
+    def test_asyncio_fan_in(self, stub_server):
+        pytest.importorskip("aiohttp")
+        from discord_sender.aio import AsyncDiscordUser
+
+        async def flow():
+            async with AsyncDiscordUser(base_url=stub_server.url) as user:
+                await user.login_with_token(stub.STUB_TOKEN)
+                dms = await asyncio.gather(*(user.get_dms(True) for _ in range(10)))
+                ids = await asyncio.gather(
+                    *(user.get_channel_id("30") for _ in range(10))
+                )
+                return dms, ids, user.single_flight.shared
+
+        dms, ids, shared = asyncio.run(flow())
+        assert all(result == dms[0] for result in dms)
+        assert len(set(ids)) == 1
+        assert shared == 18
+        assert stub_server.requests.count(("GET", "/api/v9/users/@me/channels")) == 1
+        assert stub_server.requests.count(("POST", "/api/v9/users/@me/channels")) == 1
+
+
+class TestAttachments:
+    def test_upload(self, stub_server, stub_user, tmp_path):
+        report = tmp_path / "report.txt"
+        report.write_bytes(b"line\n" * 1000)
+        extra = io.BytesIO(b"skip" + b"\x00\x01" * 10)
+        extra.seek(4)
+        progress = []
+        stub_user.send_message_to_channel(
+            "logs",
+            "300",
+            files=[str(report), extra],
+            progress=lambda sent, total: progress.append((sent, total)),
+        )
+        message = stub_server.messages["300"][0]
+        assert message["content"] == "logs"
+        assert [item["filename"] for item in message["attachments"]] == [
+            "report.txt",
+            "file1",
+        ]
+        assert stub_server.attachments[message["id"]] == [
+            b"line\n" * 1000,
+            b"\x00\x01" * 10,
+        ]
+        assert progress[-1][0] == progress[-1][1]
+        assert extra.tell() == 4
+
+    def test_upload_to_user_is_rate_limited_and_checked(
+        self, stub_server, stub_user, tmp_path
+    ):
+        path = tmp_path / "a.bin"
+        path.write_bytes(b"x" * 5000)
+        stub_server.rate_limit_every = 2
+        stub_server.retry_after = 0.01
+        stub_user.send_message_to_user("file", "10", files=[path])
+        # Both opening the channel and the upload got a 429 and went again
+        assert stub_server.rate_limited == 2
+        assert stub_server.requests.count(("POST", "/api/v9/channels/300/messages")) == 2
+        (message,) = stub_server.messages["300"]
+        assert stub_server.attachments[message["id"]] == [b"x" * 5000]
+        stub_server.rate_limit_every = 0
+        with pytest.raises(discord_exceptions.ChannelNotFoundError):
+            stub_user.send_message_to_channel("file", "999", files=[path])
+
+    def test_rewound_for_retries(self):
+        bodies = []
+
+        def post(url, **kwargs):
+            bodies.append(kwargs["data"].read())
+            if len(bodies) == 1:
+                raise requests.ConnectionError()
+            return limited_response(200)
+
+        transport = discord.Transport()
+        transport.session = mock.Mock()
+        transport.session.post.side_effect = post
+        with multipart.MultipartBody(
+            [("payload_json", b"{}", "application/json")], [io.BytesIO(b"abc")]
+        ) as body:
+            transport.request(
+                "POST",
+                "/channels/1/messages",
+                retry=retry.RetryPolicy(sleep=lambda seconds: None),
+                data=body,
+            )
+        assert bodies[0] == bodies[1]
+        assert len(bodies[0]) == len(body)
+        assert b'filename="file0"' in bodies[0]
+
+    def test_memory_stays_flat(self, tmp_path):
+        path = tmp_path / "big.bin"
+        with open(path, "wb") as f:
+            for _ in range(20):
+                f.write(os.urandom(1 << 20))
+        tracemalloc.start()
+        try:
+            with multipart.MultipartBody([], [path]) as body:
+                read = 0
+                while chunk := body.read(16384):
+                    read += len(chunk)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert read == len(body) > 20 << 20
+        assert peak < 1 << 20
+
+    def test_rejects_unseekable(self):
+        with pytest.raises(discord_exceptions.ArgumentError):
+            multipart.MultipartBody([], [b"raw bytes"])
+
+
+class TestMessages:
+    @staticmethod
+    def seed(server, count=250):
+        server.messages["300"] = [
+            {
+                "id": str(500 + n),
+                "channel_id": "300",
+                "content": f"message {n}",
+                "author": {"id": str(10 + n % 2), "username": f"user{n % 2}"},
+            }
+            for n in range(count)
+        ]
+
+    @staticmethod
+    def pages(server):
+        return server.requests.count(("GET", "/api/v9/channels/300/messages"))
+
+    def test_newest_first_across_pages(self, stub_server, stub_user):
+        self.seed(stub_server)
+        messages = list(stub_user.iter_messages("300"))
+        assert [m.message_id for m in messages] == [str(n) for n in range(749, 499, -1)]
+        assert self.pages(stub_server) == 3
+        assert messages[0].content == "message 249"
+        assert messages[0].author is messages[2].author
+
+    def test_limit_and_before(self, stub_server, stub_user):
+        self.seed(stub_server)
+        messages = list(stub_user.iter_messages("300", before="700", limit=120))
+        assert [m.message_id for m in messages] == [str(n) for n in range(699, 579, -1)]
+        assert self.pages(stub_server) == 2
+
+    def test_after_is_oldest_first(self, stub_server, stub_user):
+        self.seed(stub_server)
+        messages = list(stub_user.iter_messages("300", after="509", prefetch=0))
+        assert [m.message_id for m in messages] == [str(n) for n in range(510, 750)]
+
+    def test_before_and_after(self, stub_server, stub_user):
+        self.seed(stub_server)
+        messages = list(stub_user.iter_messages("300", before="700", after="589"))
+        assert [m.message_id for m in messages] == [str(n) for n in range(699, 589, -1)]
+        assert self.pages(stub_server) == 2
+
+    def test_read_ahead_is_bounded(self, stub_server, stub_user):
+        self.seed(stub_server, 1000)
+        messages = stub_user.iter_messages("300", prefetch=2)
+        next(messages)
+        time.sleep(0.3)
+        # The page being read, two queued and one waiting for room
+        assert self.pages(stub_server) <= 4
+        messages.close()
+        fetched = self.pages(stub_server)
+        time.sleep(0.2)
+        assert self.pages(stub_server) == fetched < 10
+
+    def test_unknown_channel(self, stub_user):
+        with pytest.raises(discord_exceptions.ChannelNotFoundError):
+            next(stub_user.iter_messages("999"))
+
+    def test_deadline_starts_with_the_call(self, stub_server, stub_user):
+        self.seed(stub_server)
+        messages = stub_user.iter_messages("300", deadline=0.05)
+        time.sleep(0.1)
+        with pytest.raises(discord_exceptions.DeadlineExceeded):
+            next(messages)
+        assert self.pages(stub_server) == 0
+
+    def test_read_ahead_passes_errors(self):
+        def items():
+            yield 1
+            raise ValueError("broken")
+
+        results = tools.read_ahead(items())
+        assert next(results) == 1
+        with pytest.raises(ValueError, match="broken"):
+            next(results)
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.01)
+
+
+class TestGateway:
+    @staticmethod
+    def listings(server):
+        return server.requests.count(("GET", "/api/v9/users/@me/channels"))
+
+    def test_events_update_cache_and_tracker(self, stub_server, stub_user):
+        stub_user.channel_cache.ttl = 0
+        dms = tracker.DMTracker(stub_user)
+        events = []
+        dms.on_new(lambda chan: events.append(("new", chan.channel_id)))
+        dms.on_closed(lambda chan: events.append(("closed", chan.channel_id)))
+        dms.on_changed(lambda old, new: events.append(("changed", new.name)))
+        listener = stub_user.listen(trackers=[dms])
+        assert listener.wait_ready(5)
+        assert sorted(dms.channels) == ["300", "301"]
+
+        stub_server.add_channel(
+            {"id": "302", "type": 1, "recipients": [{"id": "30", "username": "thirty"}]}
+        )
+        stub_server.update_channel(
+            dict(stub_server.find_channel("301"), name="renamed")
+        )
+        stub_server.remove_channel("300")
+        wait_for(lambda: listener.events == 3)
+        assert events == [("new", "302"), ("changed", "renamed"), ("closed", "300")]
+        # Served from the live cache even though its ttl is 0
+        assert stub_user.get_channel_id("30") == "302"
+        assert stub_user.resolve_channel(username="thirty").source == "cache"
+        assert stub_user.channel_cache.channel("300") is None
+        assert self.listings(stub_server) == 1
+        assert stub_server.requests.count(("GET", "/api/v9/gateway")) == 1
+        stub_user.close()
+        assert listener.error is None
+        wait_for(lambda: not stub_server.gateways)
+
+    def test_reconnect_takes_new_snapshot(self, stub_server, stub_user):
+        dms = tracker.DMTracker(stub_user)
+        added = []
+        dms.on_new(added.append)
+        listener = stub_user.listen(
+            trackers=[dms], backoff=retry.RetryPolicy(base=0.05, jitter=False)
+        )
+        assert listener.wait_ready(5)
+        # Missed while disconnected, only the next snapshot can see it
+        stub_server.channels.append(
+            {"id": "302", "type": 1, "recipients": [{"id": "30"}]}
+        )
+        stub_server.disconnect_gateways()
+        wait_for(lambda: listener.snapshots == 2)
+        assert [chan.channel_id for chan in added] == ["302"]
+        assert listener.reconnects == 1
+        assert self.listings(stub_server) == 2
+        assert stub_user.channel_cache.live
+
+    def test_missing_heartbeat_ack_reconnects(self, stub_server, stub_user):
+        stub_server.heartbeat_interval = 0.05
+        stub_server.ack_heartbeats = False
+        listener = stub_user.listen(backoff=retry.RetryPolicy(base=0.01))
+        wait_for(lambda: listener.snapshots >= 2)
+        assert stub_server.identified >= 2
+
+    def test_last_error_is_kept(self, stub_user):
+        stub_user.get_dms = mock.Mock(side_effect=KeyError("recipients"))
+        listener = stub_user.listen(backoff=retry.RetryPolicy(base=0.01))
+        wait_for(lambda: listener.reconnects >= 2)
+        assert isinstance(listener.last_error, KeyError)
+        assert listener.error is None
+
+    def test_rejected_token_stops(self, stub_server, stub_user):
+        stub_server.token = "other"
+        listener = stub_user.listen(stub_server.gateway_url)
+        wait_for(lambda: listener.error is not None)
+        assert listener.error.code == 4004
+        assert not listener.ready.is_set()
+        assert not stub_user.channel_cache.live
+
+    def test_frames(self):
+        for size in (0, 5, 300, 70000):
+            payload = os.urandom(size)
+            for mask in (True, False):
+                frame = gateway.encode_frame(gateway.OP_TEXT, payload, mask)
+                assert gateway.parse_frame(frame + b"next") == (
+                    True,
+                    gateway.OP_TEXT,
+                    payload,
+                    len(frame),
+                )
+                assert gateway.parse_frame(frame[:-1]) is None
+
+
+class TestBenchmarks:
+    def test_rate_limit_injection(self):
+        with stub.StubDiscordServer(
+            channels=stub.synthetic_channels(3), rate_limit_every=2, retry_after=0.01
+        ) as server:
+            with discord.DiscordUser(
+                transport=discord.Transport(base_url=server.url)
+            ) as user:
+                user.login_with_token(stub.STUB_TOKEN)
+                assert len(user.get_dms(True)) == 3
+            assert server.rate_limited == 1
+            assert server.requests.count(("GET", "/api/v9/users/@me/channels")) == 2
+
+    def test_synthetic_channels(self):
+        channels = stub.synthetic_channels(20)
+        assert len({channel["id"] for channel in channels}) == 20
+        assert [len(channel["recipients"]) for channel in channels[:2]] == [5, 1]
+
+    def test_run_and_compare(self):
+        from benchmarks import run
+
+        results = run.run([10], sends=5, repeat=1)
+        assert set(results) == {
+            "login_token",
+            "get_dms[10]",
+            "parse_dms[10]",
+            "send_throughput",
+        }
+        assert run.compare(results, results, 0.2) == []
+        slower = dict(results, login_token=results["login_token"] * 2)
+        slower["send_throughput"] = results["send_throughput"] / 2
+        assert len(run.compare(results, slower, 0.2)) == 2
+
+
+class TestBenchCommand:
+    def test_percentile(self):
+        values = [float(n) for n in range(1, 101)]
+        assert bench.percentile(values, 50) == 50.5
+        assert bench.percentile(values, 99) == pytest.approx(99.01)
+        assert bench.percentile([3.0], 95) == 3.0
+
+    def test_bench_against_stub(self):
+        with bench.stub_target(20) as target:
+            results = bench.run_bench(target, iterations=5, warmup=1)
+        assert list(results) == list(bench.OPERATIONS)
+        for result in results.values():
+            assert result["p50"] <= result["p95"] <= result["p99"]
+            assert result["requests_per_second"] > 0
+            assert result["alloc_peak_bytes"] > 0
+        assert "peak KiB" in bench.format_results(results)
+
+    def test_nothing_sent_without_channel(self, stub_server):
+        target = bench.Target(stub_server.url, stub.STUB_TOKEN)
+        transport = discord.Transport(base_url=stub_server.url)
+        assert list(bench.operations(target, transport)) == ["login", "get_dms"]
+
+    def test_profile_dumps(self, tmp_path, capsys):
+        argv = ["profile", "--ops", "get_dms", "--iterations", "3", "--warmup", "0"]
+        assert main(argv + ["--output-dir", str(tmp_path)]) == 0
+        assert "discord.py" in capsys.readouterr().out
+        assert pstats.Stats(str(tmp_path / "get_dms.prof")).total_calls > 0
+        assert tracemalloc.Snapshot.load(str(tmp_path / "get_dms.tracemalloc"))
+
+    def test_bench_json(self, capsys):
+        assert main(["bench", "--ops", "send", "--iterations", "3", "--json"]) == 0
+        assert set(json.loads(capsys.readouterr().out)) == {"send"}
+        with pytest.raises(SystemExit):
+            main(["bench", "--ops", "delete"])
+
+
+class TestMetrics:
+    def test_observer_sees_templates(self, stub_user):
+        events = []
+
+        class Recorder(hooks.RequestObserver):
+            def on_request_start(self, info):
+                events.append(("start", info.method, info.endpoint))
+
+            def on_request_end(self, info):
+                events.append(("end", info.endpoint, info.status, info.response_bytes))
+
+        stub_user.add_observer(Recorder())
+        stub_user.send_message_to_channel("hi", "300")
+        assert events[-2] == ("start", "POST", "/channels/{channel_id}/messages")
+        end = events[-1]
+        assert end[:3] == ("end", "/channels/{channel_id}/messages", 200)
+        assert end[3] > 0
+
+    def test_collector(self, stub_user):
+        metrics = stub_user.add_observer(hooks.MetricsCollector())
+        stub_user.send_message_to_channel("a", "300")
+        stub_user.send_message_to_channel("b", "301")
+        with pytest.raises(discord_exceptions.ChannelNotFoundError):
+            stub_user.send_message_to_channel("c", "999")
+        endpoint = metrics.as_dict()["endpoints"][
+            "POST /channels/{channel_id}/messages"
+        ]
+        assert endpoint["requests"] == 3
+        assert endpoint["statuses"] == {"200": 2, "404": 1}
+        assert endpoint["request_bytes"] > 0
+        assert metrics.as_dict()["error_handling"]["ChannelNotFoundError"]["count"] == 1
+        text = metrics.prometheus()
+        assert (
+            'discord_sender_request_duration_seconds_count{method="POST",'
+            'endpoint="/channels/{channel_id}/messages",status="200"} 2'
+        ) in text
+        assert 'le="+Inf"} 2' in text
+        assert (
+            'discord_sender_error_handling_seconds_count{error="ChannelNotFoundError"} 1'
+        ) in text
+
+    def test_retries_and_errors(self):
+        transport = discord.Transport()
+        metrics = transport.add_observer(hooks.MetricsCollector())
+        transport.session = mock.Mock()
+        transport.session.get.side_effect = [
+            requests.ConnectionError(),
+            limited_response(200),
+        ]
+        policy = retry.RetryPolicy(sleep=lambda seconds: None)
+        transport.request("GET", "/users/@me", retry=policy)
+        endpoint = metrics.as_dict()["endpoints"]["GET /users/@me"]
+        assert endpoint["statuses"] == {"ConnectionError": 1, "200": 1}
+        assert endpoint["retries"] == 1
+
+    def test_other_errors_end_the_request(self):
+        events = []
+
+        class Recorder(hooks.RequestObserver):
+            def on_request_start(self, info):
+                events.append(("start", info.started, info.duration))
+
+            def on_request_end(self, info):
+                events.append(("end", info.outcome, info.duration))
+
+        transport = discord.Transport()
+        transport.add_observer(Recorder())
+        transport.session = mock.Mock()
+        transport.session.get.side_effect = requests.exceptions.ChunkedEncodingError()
+        with pytest.raises(requests.exceptions.ChunkedEncodingError):
+            transport.request("GET", "/users/@me")
+        (_, started, duration), (_, outcome, elapsed) = events
+        assert started > 0 and duration is None
+        assert outcome == "ChunkedEncodingError"
+        assert 0 <= elapsed < 1
+
+    def test_histogram_buckets(self):
+        histogram = hooks.Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        assert histogram.cumulative() == [("0.1", 2), ("1.0", 3), ("+Inf", 4)]
+        assert histogram.count == 4
+
+
+class TestAsyncUser:
+    @pytest.fixture(autouse=True)
+    def needs_aiohttp(self):
+        pytest.importorskip("aiohttp")
+
+    @staticmethod
+    def run(coro):
+        return asyncio.run(coro)
+
+    def test_token_flow(self, stub_server):
+        from discord_sender.aio import AsyncDiscordUser
+
+        async def flow():
+            async with AsyncDiscordUser(base_url=stub_server.url) as user:
+                await user.login_with_token(stub.STUB_TOKEN)
+                dms = await user.get_dms(True)
+                with pytest.warns(UserWarning):
+                    chan = await user.get_channel_info("301")
+                    await user.send_message_to_username("hi", "ten")
+                found = await user.get_user_info_by_id("20")
+                await user.send_message_to_channel("direct", "301")
+                return dms, chan, found
+
+        dms, chan, found = self.run(flow())
+        assert dms == discord.parse_dms(stub_server.channels)
+        assert chan.name == "group"
+        assert found.user_id == "20"
+        assert [msg["content"] for msg in stub_server.messages["300"]] == ["hi"]
+        assert [msg["content"] for msg in stub_server.messages["301"]] == ["direct"]
+        assert stub_server.requests.count(("GET", "/api/v9/users/@me/channels")) == 1
+        # The dm channel came from the listing, nothing was opened
+        assert ("POST", "/api/v9/users/@me/channels") not in stub_server.requests
+
+    def test_username_evicted_from_cache(self):
+        from discord_sender.aio import AsyncDiscordUser
+
+        async def flow(url):
+            async with AsyncDiscordUser(base_url=url, cache_size=4) as user:
+                await user.login_with_token(stub.STUB_TOKEN)
+                return await user.resolve_channel(username="user1")
+
+        with stub.StubDiscordServer(channels=stub.synthetic_channels(10)) as server:
+            resolution = self.run(flow(server.url))
+        assert resolution.user_id == server.channels[1]["recipients"][0]["id"]
+
+    def test_errors(self, stub_server):
+        from discord_sender.aio import AsyncDiscordUser
+
+        async def flow():
+            async with AsyncDiscordUser(base_url=stub_server.url) as user:
+                with pytest.raises(discord_exceptions.InvalidCredentialsException):
+                    await user.get_dms()
+                with pytest.raises(
+                    discord_exceptions.InvalidCredentialsException, match="Invalid"
+                ):
+                    await user.login_with_token("nope")
+                await user.login_with_credentials(
+                    stub_server.email, stub_server.password
+                )
+                with pytest.raises(discord_exceptions.AlreadyLoggedInException):
+                    await user.login_with_token(stub.STUB_TOKEN)
+                with pytest.raises(discord_exceptions.ChannelNotFoundError):
+                    await user.send_message_to_channel("", "999")
+                with pytest.raises(discord_exceptions.UnknownUserException):
+                    await user.get_channel_id("999")
+
+        self.run(flow())
+
+
+class TestCompactModels:
+    def test_slots(self):
+        for model in (
+            channel.Channel("1", []),
+            OtherUser("1"),
+            info.DiscordLoginInfo(token="1"),
+        ):
+            assert not hasattr(model, "__dict__")
+        assert info.DiscordLoginInfo(token="1", uid="2").get_token() == "1"
+
+    def test_interned_users(self):
+        dms = discord.parse_dms(DMS)
+        assert dms[0].recipients[0] is dms[2].recipients[0]
+        assert OtherUser.intern("10", "ten") is dms[0].recipients[0]
+        assert OtherUser.intern("10", "renamed") is not dms[0].recipients[0]
+
+
+class TestHashing:
+    def test_user_hash(self):
+        assert len({OtherUser("1", "a"), OtherUser("1", "b"), OtherUser("2")}) == 2
+        assert {OtherUser("1"): "x"}[OtherUser("1")] == "x"
+
+    def test_channel_hash(self):
+        first = channel.Channel("1", [OtherUser("10"), OtherUser("20")])
+        second = channel.Channel("1", [OtherUser("20"), OtherUser("10")])
+        assert first == second
+        assert hash(first) == hash(second)
+        assert len({first, second, channel.Channel("2", [])}) == 2
+        assert first != channel.Channel("1", [OtherUser("10"), OtherUser("10")])
+
+    def test_diff_channels(self):
+        old = discord.parse_dms(DMS)
+        new = discord.parse_dms(
+            [
+                DMS[0],
+                dict(DMS[2], name="renamed"),
+                {"id": "4", "recipients": [], "type": 1},
+            ]
+        )
+        diff = channel.diff_channels(old, new)
+        assert [chan.channel_id for chan in diff.added] == ["4"]
+        assert [chan.channel_id for chan in diff.removed] == ["2"]
+        assert [(a.name, b.name) for a, b in diff.changed] == [("group", "renamed")]
+        assert channel.diff_channels(new, new) == ([], [], [])
+
+
 class TestOtheruser:
     def test_repr(self):
         user = OtherUser("12345")